@@ -6,7 +6,7 @@ from sqlalchemy.ext.asyncio import AsyncEngine
 from alembic import context
 
 from app import models  # noqa
-from app.database import engine, DATABASE_URL
+from app.database import get_engine
 from sqlmodel import SQLModel
 
 # Alembic Config object
@@ -20,7 +20,8 @@ if config.config_file_name is not None:
 target_metadata = SQLModel.metadata
 
 # Update URL in Alembic config
-config.set_main_option("sqlalchemy.url", DATABASE_URL)
+engine = get_engine()
+config.set_main_option("sqlalchemy.url", engine.url.render_as_string(hide_password=False))
 
 
 def run_migrations_offline() -> None:
@@ -0,0 +1,48 @@
+"""link conversation roots
+
+Revision ID: 0b7d2c9e4f31
+Revises: e5a93d0f7b14
+Create Date: 2026-10-18 14:02:41.518337
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0b7d2c9e4f31'
+down_revision: Union[str, Sequence[str], None] = 'e5a93d0f7b14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Replies now claim a standalone capsule by setting its conversation_id, older roots never had it set
+    op.execute(
+        """
+        UPDATE capsule
+        SET conversation_id = child.conversation_id
+        FROM capsule AS child
+        WHERE child.replying_to_id = capsule.id
+          AND capsule.conversation_id IS NULL
+          AND child.conversation_id IS NOT NULL
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Earlier code only set conversation_id on replies, roots are found through replying_to_id
+    op.execute(
+        """
+        UPDATE capsule
+        SET conversation_id = NULL
+        WHERE replying_to_id IS NULL
+          AND conversation_id IS NOT NULL
+        """
+    )
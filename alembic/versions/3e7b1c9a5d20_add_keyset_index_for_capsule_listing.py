@@ -0,0 +1,30 @@
+"""add keyset index for capsule listing
+
+Revision ID: 3e7b1c9a5d20
+Revises: b3f839c3cc9e
+Create Date: 2026-10-18 10:32:05.184277
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3e7b1c9a5d20'
+down_revision: Union[str, Sequence[str], None] = 'b3f839c3cc9e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_capsule_user_id_release_date', 'capsule', ['user_id', 'release_date', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_capsule_user_id_release_date', table_name='capsule')
@@ -0,0 +1,51 @@
+"""allow multiple scoped api keys
+
+Revision ID: 4f6e8a1b2c93
+Revises: c8f1a6d3e572
+Create Date: 2026-10-18 16:21:05.774310
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4f6e8a1b2c93'
+down_revision: Union[str, Sequence[str], None] = 'c8f1a6d3e572'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Existing keys become each user's write-scoped "default" key
+    op.add_column('apikey', sa.Column('name', sqlmodel.sql.sqltypes.AutoString(length=32), nullable=False, server_default='default'))
+    op.add_column('apikey', sa.Column('scope', sqlmodel.sql.sqltypes.AutoString(length=8), nullable=False, server_default='write'))
+    op.add_column('apikey', sa.Column('creation_date', sa.DateTime(), nullable=False, server_default=sa.func.now()))
+    op.add_column('apikey', sa.Column('expires_at', sa.DateTime(), nullable=True))
+    op.alter_column('apikey', 'name', server_default=None)
+    op.alter_column('apikey', 'scope', server_default=None)
+    op.alter_column('apikey', 'creation_date', server_default=None)
+    op.create_index('ix_apikey_user_id_name', 'apikey', ['user_id', 'name'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Only one key per user fits the old model, keep the oldest
+    op.execute(
+        """
+        DELETE FROM apikey
+        WHERE id NOT IN (
+            SELECT DISTINCT ON (user_id) id FROM apikey ORDER BY user_id, creation_date
+        )
+        """
+    )
+    op.drop_index('ix_apikey_user_id_name', table_name='apikey')
+    op.drop_column('apikey', 'expires_at')
+    op.drop_column('apikey', 'creation_date')
+    op.drop_column('apikey', 'scope')
+    op.drop_column('apikey', 'name')
@@ -0,0 +1,37 @@
+"""add partial index for unsent capsules
+
+Revision ID: 7c2f4e81b6a9
+Revises: 3e7b1c9a5d20
+Create Date: 2026-10-18 11:02:47.530915
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c2f4e81b6a9'
+down_revision: Union[str, Sequence[str], None] = '3e7b1c9a5d20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        'ix_capsule_release_date_unsent',
+        'capsule',
+        ['release_date'],
+        unique=False,
+        postgresql_where=sa.text('sent = false'),
+        postgresql_include=['id'],
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_capsule_release_date_unsent', table_name='capsule')
@@ -0,0 +1,36 @@
+"""index undelivered dispatches
+
+Revision ID: 9a3d5c7e1f28
+Revises: 4f6e8a1b2c93
+Create Date: 2026-10-18 16:20:05.114273
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9a3d5c7e1f28'
+down_revision: Union[str, Sequence[str], None] = '4f6e8a1b2c93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        'ix_capsule_scheduled_at_undelivered',
+        'capsule',
+        ['scheduled_at'],
+        unique=False,
+        postgresql_where=sa.text('sent = false AND scheduled_at IS NOT NULL'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_capsule_scheduled_at_undelivered', table_name='capsule')
@@ -0,0 +1,39 @@
+"""hmac api keys with unique prefix
+
+Revision ID: c8f1a6d3e572
+Revises: 0b7d2c9e4f31
+Create Date: 2026-10-18 15:10:27.243981
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c8f1a6d3e572'
+down_revision: Union[str, Sequence[str], None] = '0b7d2c9e4f31'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.drop_index(op.f('ix_apikey_hashed_key'), table_name='apikey')
+    op.drop_index(op.f('ix_apikey_prefix'), table_name='apikey')
+    op.create_index(op.f('ix_apikey_prefix'), 'apikey', ['prefix'], unique=True)
+    # Existing keys keep their salt until they are rehashed on first use
+    op.alter_column('apikey', 'salt', existing_type=sqlmodel.sql.sqltypes.AutoString(), nullable=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Rehashed keys cannot be turned back into salted hashes, they have to be regenerated
+    op.execute("DELETE FROM apikey WHERE salt IS NULL")
+    op.alter_column('apikey', 'salt', existing_type=sqlmodel.sql.sqltypes.AutoString(), nullable=False)
+    op.drop_index(op.f('ix_apikey_prefix'), table_name='apikey')
+    op.create_index(op.f('ix_apikey_prefix'), 'apikey', ['prefix'], unique=False)
+    op.create_index(op.f('ix_apikey_hashed_key'), 'apikey', ['hashed_key'], unique=False)
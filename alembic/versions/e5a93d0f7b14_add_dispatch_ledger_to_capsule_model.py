@@ -0,0 +1,48 @@
+"""add dispatch ledger to capsule model
+
+Revision ID: e5a93d0f7b14
+Revises: 7c2f4e81b6a9
+Create Date: 2026-10-18 11:26:13.904512
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a93d0f7b14'
+down_revision: Union[str, Sequence[str], None] = '7c2f4e81b6a9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('capsule', sa.Column('scheduled_at', sa.DateTime(), nullable=True))
+    op.drop_index('ix_capsule_release_date_unsent', table_name='capsule')
+    op.create_index(
+        'ix_capsule_release_date_undispatched',
+        'capsule',
+        ['release_date'],
+        unique=False,
+        postgresql_where=sa.text('sent = false AND scheduled_at IS NULL'),
+        postgresql_include=['id'],
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_capsule_release_date_undispatched', table_name='capsule')
+    op.create_index(
+        'ix_capsule_release_date_unsent',
+        'capsule',
+        ['release_date'],
+        unique=False,
+        postgresql_where=sa.text('sent = false'),
+        postgresql_include=['id'],
+    )
+    op.drop_column('capsule', 'scheduled_at')
@@ -1,27 +1,119 @@
+from app.config import get_settings
+from app.database import async_session
 from app.models import Capsule, Conversation
-from app.utils.authentication import authenticate_api_key
-from app.utils.encryption import encrypt_content, decrypt_content
+from app.capsules.schemas import CapsuleSchema, CapsuleCreateSchema
+from app.utils.authentication import authenticate_api_key, READ_SCOPE
+from app.utils.encryption import encrypt_content, encrypt_contents, decrypt_content, decrypt_contents
 from app.utils.helpers import current_time
+from app.utils.releases import notify_release, notify_releases
 
+from sqlalchemy import insert, update, tuple_, literal
+from sqlalchemy.orm import aliased, contains_eager
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import select
-from datetime import timedelta
-from typing import Optional, List, Tuple
-from uuid import UUID
+from datetime import datetime, timedelta
+from typing import Optional, List, Tuple, Dict, Any, AsyncIterator
+from uuid import UUID, uuid4
 from fastapi import HTTPException, status
+from pydantic import ValidationError
+import base64
 
-async def list_capsules(session: AsyncSession, api_key: str) -> List[Capsule]:
-    key_obj = await authenticate_api_key(session, api_key)
+async def decrypt_capsules(capsules: List[Capsule]) -> None:
+    # Batches smaller than the threshold are cheaper to decrypt inline than on the thread pool
+    if len(capsules) < get_settings().bulk_crypto_threshold:
+        for capsule in capsules:
+            capsule.content = decrypt_content(capsule.content)
+        return
+    contents = await decrypt_contents([capsule.content for capsule in capsules])
+    for capsule, content in zip(capsules, contents):
+        capsule.content = content
+
+CAPSULE_PAGE_SIZE = 50
+MAX_CAPSULE_PAGE_SIZE = 200
+
+def encode_cursor(capsule: Capsule) -> str:
+    raw = f"{capsule.release_date.isoformat()}|{capsule.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    try:
+        release_date, capsule_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(release_date), UUID(capsule_id)
+    except ValueError:
+        raise HTTPException(detail="Invalid cursor given.", status_code=status.HTTP_400_BAD_REQUEST)
+
+def released_capsules(user_id: UUID):
+    # Newest first, keyed on (release_date, id) so pages are stable under concurrent inserts
+    return (select(Capsule)
+            .where(Capsule.user_id == user_id)
+            .where(Capsule.release_date < current_time())
+            .order_by(Capsule.release_date.desc(), Capsule.id.desc()))
+
+async def list_capsules(session: AsyncSession, api_key: str, cursor: Optional[str] = None, limit: int = CAPSULE_PAGE_SIZE) -> Dict[str, Any]:
+    key_obj = await authenticate_api_key(session, api_key, READ_SCOPE)
     user = key_obj.user
-    time = current_time()
-    capsules = await session.execute(select(Capsule)
-                            .where(Capsule.user_id == user.id)
-                            .where(Capsule.release_date < time)
-                            .order_by(Capsule.release_date.desc())
-                            ).all()
-    for capsule in capsules:
-        capsule.content = decrypt_content(capsule.content)
-    return capsules
+    limit = min(limit, MAX_CAPSULE_PAGE_SIZE)
+    stmt = released_capsules(user.id)
+    if cursor:
+        release_date, capsule_id = decode_cursor(cursor)
+        stmt = stmt.where(tuple_(Capsule.release_date, Capsule.id) < tuple_(release_date, capsule_id))
+    result = await session.execute(stmt.limit(limit + 1))
+    capsules = result.scalars().all()
+    next_cursor = None
+    if len(capsules) > limit:
+        capsules = capsules[:limit]
+        next_cursor = encode_cursor(capsules[-1])
+    await decrypt_capsules(capsules)
+    return {
+        "capsules": capsules,
+        "next_cursor": next_cursor,
+    }
+
+async def stream_capsules(session: AsyncSession, api_key: str) -> AsyncIterator[str]:
+    # Authenticate up front so a bad key still gets a 401 before the stream starts
+    key_obj = await authenticate_api_key(session, api_key, READ_SCOPE)
+    return _stream_capsule_rows(key_obj.user.id)
+
+async def _stream_capsule_rows(user_id: UUID) -> AsyncIterator[str]:
+    async with async_session() as session:
+        result = await session.stream_scalars(released_capsules(user_id)
+                                              .execution_options(yield_per=get_settings().capsule_stream_batch_size))
+        async for capsules in result.partitions():
+            contents = await decrypt_contents([capsule.content for capsule in capsules])
+            for capsule, content in zip(capsules, contents):
+                row = CapsuleSchema.model_validate(capsule, from_attributes=True)
+                row.content = content
+                yield row.model_dump_json() + "\n"
+
+async def insert_reply(session: AsyncSession, capsule: Capsule, reply: Capsule) -> None:
+    # Inserts the reply and advances the conversation in one statement. Foreign keys are checked at the
+    # end of the statement, so a new conversation and its first reply can reference each other. The
+    # conditional UPDATE locks the row it changes and matches nothing if another reply got there first.
+    conversation_id = reply.conversation_id or uuid4()
+    capsule.conversation_id = conversation_id
+    capsule.replying_to_id = reply.id
+    ctes = [insert(Capsule).values(**capsule.model_dump()).cte("new_capsule")]
+    if reply.conversation_id:
+        guard = (update(Conversation)
+                 .where(Conversation.id == conversation_id)
+                 .where(Conversation.latest_capsule_id == reply.id)
+                 .values(latest_capsule_id=capsule.id)
+                 .returning(Conversation.id)
+                 .cte("advanced_conversation"))
+    else:
+        ctes.append(insert(Conversation)
+                    .values(id=conversation_id, user_id=capsule.user_id, latest_capsule_id=capsule.id)
+                    .cte("new_conversation"))
+        guard = (update(Capsule)
+                 .where(Capsule.id == reply.id)
+                 .where(Capsule.conversation_id == None)
+                 .values(conversation_id=conversation_id)
+                 .returning(Capsule.id)
+                 .cte("linked_parent"))
+    result = await session.execute(select(guard.c.id).add_cte(*ctes))
+    if result.first() is None:
+        await session.rollback()
+        raise HTTPException(detail="Capsule ID given is no longer the latest in its conversation.", status_code=status.HTTP_409_CONFLICT)
 
 async def create_capsule(session: AsyncSession, api_key: str, content: str, time_held: timedelta, replying_to_id: Optional[UUID]) -> dict[str, str]:
     key_obj = await authenticate_api_key(session, api_key)
@@ -43,33 +135,63 @@ async def create_capsule(session: AsyncSession, api_key: str, content: str, time
             raise HTTPException(detail="Capsule ID given does not belong to you.", status_code=status.HTTP_403_FORBIDDEN)
         if reply.release_date > current_time():
             raise HTTPException(detail="Capsule ID given is still buried.", status_code=status.HTTP_403_FORBIDDEN)
-        conversation = reply.conversation
-        if not conversation:
-            conversation = Conversation(
-                user_id=user.id,
-                latest_capsule_id=reply.id
-            )
-            session.add(conversation)
-            await session.commit()
-            await session.refresh(conversation)
-        capsule.conversation_id = conversation.id
-        capsule.replying_to_id = reply.id
-        session.add(capsule)
-        await session.commit()
-        await session.refresh(capsule)
-        conversation.latest_capsule_id = capsule.id
-        await session.commit()
+        await insert_reply(session, capsule, reply)
     else:
         session.add(capsule)
-        await session.commit()
-        await session.refresh(capsule)
+    await notify_release(session, capsule)
+    await session.commit()
     return {
         "details": "capsule successfully buried.",
     }
 
-async def retrieve_capsule(session: AsyncSession, api_key: str, capsule_id: UUID) -> Capsule:
+async def create_capsules(session: AsyncSession, api_key: str, items: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
     key_obj = await authenticate_api_key(session, api_key)
     user = key_obj.user
+    if not user.email_verified:
+        raise HTTPException(detail="You need to verify your email before creating capsules.", status_code=status.HTTP_403_FORBIDDEN)
+    valid: List[Tuple[int, CapsuleCreateSchema]] = []
+    errors = []
+    for index, item in enumerate(items):
+        try:
+            capsule = CapsuleCreateSchema.model_validate(item)
+        except ValidationError as e:
+            detail = "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" if error["loc"] else error["msg"] for error in e.errors())
+            errors.append({"index": index, "detail": detail})
+            continue
+        # Replies lock and update a conversation, they go through /capsules/post one at a time
+        if capsule.replying_to_id:
+            errors.append({"index": index, "detail": "Replies cannot be created in bulk."})
+            continue
+        valid.append((index, capsule))
+    if not valid:
+        return {"created": [], "errors": errors}
+    contents = [capsule.content for _, capsule in valid]
+    if len(contents) < get_settings().bulk_crypto_threshold:
+        contents = [encrypt_content(content) for content in contents]
+    else:
+        contents = await encrypt_contents(contents)
+    time = current_time()
+    rows = [{
+        "id": uuid4(),
+        "user_id": user.id,
+        "content": content,
+        "creation_date": time,
+        "time_held": capsule.time_held,
+        "release_date": time + capsule.time_held,
+        "sent": False,
+    } for (_, capsule), content in zip(valid, contents)]
+    # Ids are generated here, so the response pairs each item with its own row, RETURNING order is not guaranteed
+    await session.execute(insert(Capsule).values(rows))
+    await notify_releases(session, [(row["id"], row["release_date"]) for row in rows])
+    await session.commit()
+    return {
+        "created": [{"index": index, "id": row["id"]} for (index, _), row in zip(valid, rows)],
+        "errors": errors,
+    }
+
+async def retrieve_capsule(session: AsyncSession, api_key: str, capsule_id: UUID) -> Capsule:
+    key_obj = await authenticate_api_key(session, api_key, READ_SCOPE)
+    user = key_obj.user
     capsule = await session.get(Capsule, capsule_id)
     if not capsule:
         raise HTTPException(detail="Capsule ID given does not exist.", status_code=status.HTTP_404_NOT_FOUND)
@@ -80,32 +202,52 @@ async def retrieve_capsule(session: AsyncSession, api_key: str, capsule_id: UUID
     capsule.content = decrypt_content(capsule.content)
     return capsule
 
-async def list_conversations(session: AsyncSession, api_key: str) -> List[Conversation]:
-    key_obj = await authenticate_api_key(session, api_key)
+async def list_conversations(session: AsyncSession, api_key: str) -> Dict[str, List[Conversation]]:
+    key_obj = await authenticate_api_key(session, api_key, READ_SCOPE)
     user = key_obj.user
-    conversations = await session.execute(select(Conversation)
+    # latest_capsule is populated from the ordering join, so reply_allowed never lazy loads
+    result = await session.execute(select(Conversation)
                                       .where(Conversation.user_id == user.id)
                                       .join(Conversation.latest_capsule)
+                                      .options(contains_eager(Conversation.latest_capsule))
                                       .order_by(Capsule.release_date.desc())
-                                      ).all()
-    for conversation in conversations:
-        conversation.latest_capsule.content = decrypt_content(conversation.latest_capsule.content)
-    return conversations
+                                      )
+    conversations = result.scalars().all()
+    await decrypt_capsules([conversation.latest_capsule for conversation in conversations])
+    return {
+        "conversations": conversations,
+    }
 
-async def retrieve_conversation(session: AsyncSession, api_key: str, conversation_id: UUID) -> Tuple[List[Capsule], bool]:
-    key_obj = await authenticate_api_key(session, api_key)
+async def load_thread(session: AsyncSession, capsule_id: UUID) -> List[Capsule]:
+    # Walks replying_to_id from the given capsule back to the root in a single recursive query
+    thread = (select(Capsule.id, Capsule.replying_to_id, literal(0).label("depth"))
+              .where(Capsule.id == capsule_id)
+              .cte("thread", recursive=True))
+    parent = aliased(Capsule)
+    thread = thread.union_all(select(parent.id, parent.replying_to_id, thread.c.depth + 1)
+                              .join(thread, parent.id == thread.c.replying_to_id))
+    result = await session.execute(select(Capsule)
+                                   .join(thread, Capsule.id == thread.c.id)
+                                   .order_by(thread.c.depth))
+    return result.scalars().all()
+
+async def retrieve_conversation(session: AsyncSession, api_key: str, conversation_id: UUID) -> Dict[str, Any]:
+    key_obj = await authenticate_api_key(session, api_key, READ_SCOPE)
     user = key_obj.user
     conversation = await session.get(Conversation, conversation_id)
     if not conversation:
         raise HTTPException(detail="Conversation ID given does not exist.", status_code=status.HTTP_404_NOT_FOUND)
     if conversation.user_id != user.id:
         raise HTTPException(detail="Conversation ID given does not belong to you.", status_code=status.HTTP_403_FORBIDDEN)
-    capsule_list = []
-    capsule = conversation.latest_capsule
-    while capsule:
-        capsule.content = decrypt_content(capsule.content)
-        capsule_list.append(capsule)
-        capsule = capsule.replying_to
-    if conversation.reply_allowed:
-        return capsule_list
-    return capsule_list[1:]
\ No newline at end of file
+    capsule_list = await load_thread(session, conversation.latest_capsule_id)
+    if not capsule_list:
+        raise HTTPException(detail="Conversation ID given has no capsules.", status_code=status.HTTP_404_NOT_FOUND)
+    reply_allowed = current_time() > capsule_list[0].release_date
+    if not reply_allowed:
+        capsule_list = capsule_list[1:]
+    await decrypt_capsules(capsule_list)
+    return {
+        "id": conversation.id,
+        "capsules": capsule_list,
+        "reply_allowed": reply_allowed,
+    }
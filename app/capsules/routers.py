@@ -1,46 +1,77 @@
 from app.database import get_db
 from app.utils.authentication import access_api_key
+from app.utils.routing import get_read_db, sticky_primary
 from app.capsules.schemas import (
     CapsuleCreateSchema,
+    CapsuleBulkCreateSchema,
+    CapsuleBulkResultSchema,
     CapsuleListSchema,
     CapsuleSchema,
-    ConversationSchema,
+    ConversationThreadSchema,
     ConversationListSchema
 )
 
 from app.capsules.crud import (
+    CAPSULE_PAGE_SIZE,
+    MAX_CAPSULE_PAGE_SIZE,
     list_capsules,
+    stream_capsules,
     create_capsule,
+    create_capsules,
     retrieve_capsule,
     list_conversations,
     retrieve_conversation
 )
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
 from uuid import UUID
 
 router = APIRouter(prefix="/capsules", tags=["Capsules/Conversations"])
 
 @router.get("", response_model=CapsuleListSchema)
-async def get_capsule_list(api_key: str = Depends(access_api_key), session: AsyncSession = Depends(get_db)):
+async def get_capsule_list(cursor: Optional[str] = None, limit: int = Query(CAPSULE_PAGE_SIZE, ge=1, le=MAX_CAPSULE_PAGE_SIZE), api_key: str = Depends(access_api_key), session: AsyncSession = Depends(get_read_db)):
     return await list_capsules(
+        session,
+        api_key,
+        cursor,
+        limit
+    )
+
+@router.get("/stream")
+async def get_capsule_stream(api_key: str = Depends(access_api_key), session: AsyncSession = Depends(get_db)):
+    rows = await stream_capsules(
         session,
         api_key
     )
+    return StreamingResponse(rows, media_type="application/x-ndjson")
 
 @router.post("/post")
 async def post_capsule(user_data: CapsuleCreateSchema, api_key: str = Depends(access_api_key), session: AsyncSession = Depends(get_db)):
-    return await create_capsule(
+    capsule = await create_capsule(
         session,
         api_key,
         user_data.content,
         user_data.time_held,
         user_data.replying_to_id
     )
+    await sticky_primary.mark(api_key)
+    return capsule
+
+@router.post("/bulk", response_model=CapsuleBulkResultSchema)
+async def post_capsules(user_data: CapsuleBulkCreateSchema, api_key: str = Depends(access_api_key), session: AsyncSession = Depends(get_db)):
+    result = await create_capsules(
+        session,
+        api_key,
+        user_data.capsules
+    )
+    await sticky_primary.mark(api_key)
+    return result
 
 @router.get("{capsule_id}", response_model=CapsuleSchema)
-async def get_capsule_entry(capsule_id: UUID, api_key: str = Depends(access_api_key), session: AsyncSession = Depends(get_db)):
+async def get_capsule_entry(capsule_id: UUID, api_key: str = Depends(access_api_key), session: AsyncSession = Depends(get_read_db)):
     return await retrieve_capsule(
         session,
         api_key,
@@ -48,14 +79,14 @@ async def get_capsule_entry(capsule_id: UUID, api_key: str = Depends(access_api_
     )
 
 @router.get("/conversations", response_model=ConversationListSchema)
-async def get_conversation_list(api_key: str = Depends(access_api_key), session: AsyncSession = Depends(get_db)):
+async def get_conversation_list(api_key: str = Depends(access_api_key), session: AsyncSession = Depends(get_read_db)):
     return await list_conversations(
         session,
         api_key
     )
 
-@router.get("/conversations/{conversation_id}", response_model=ConversationSchema)
-async def get_conversation_entry(conversation_id: UUID, api_key: str = Depends(access_api_key), session: AsyncSession = Depends(get_db)):
+@router.get("/conversations/{conversation_id}", response_model=ConversationThreadSchema)
+async def get_conversation_entry(conversation_id: UUID, api_key: str = Depends(access_api_key), session: AsyncSession = Depends(get_read_db)):
     return await retrieve_conversation(
         session,
         api_key,
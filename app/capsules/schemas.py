@@ -2,7 +2,7 @@ from pydantic import BaseModel, model_validator
 from uuid import UUID
 from datetime import datetime, timedelta
 from sqlmodel import Field
-from typing import List
+from typing import Any, Dict, List
 from typing_extensions import Self
 
 class CapsuleCreateSchema(BaseModel):
@@ -18,6 +18,24 @@ class CapsuleCreateSchema(BaseModel):
             raise ValueError("The ID given to reply to must be a UUID4.")
         return self
 
+# Items are validated one by one in create_capsules, so a bad entry does not reject the whole batch
+MAX_BULK_CAPSULES = 1000
+
+class CapsuleBulkCreateSchema(BaseModel):
+    capsules: List[Dict[str, Any]] = Field(min_length=1, max_length=MAX_BULK_CAPSULES)
+
+class CapsuleBulkItemSchema(BaseModel):
+    index: int
+    id: UUID
+
+class CapsuleBulkErrorSchema(BaseModel):
+    index: int
+    detail: str
+
+class CapsuleBulkResultSchema(BaseModel):
+    created: List[CapsuleBulkItemSchema]
+    errors: List[CapsuleBulkErrorSchema]
+
 class CapsuleSchema(BaseModel):
     id: UUID
     content: str
@@ -28,11 +46,17 @@ class CapsuleSchema(BaseModel):
 
 class CapsuleListSchema(BaseModel):
     capsules: List[CapsuleSchema]
+    next_cursor: str | None = None
 
 class ConversationSchema(BaseModel):
     id: UUID
     latest_capsule: CapsuleSchema
     reply_allowed: bool
 
+class ConversationThreadSchema(BaseModel):
+    id: UUID
+    capsules: List[CapsuleSchema]
+    reply_allowed: bool
+
 class ConversationListSchema(BaseModel):
     conversations: List[ConversationSchema]
\ No newline at end of file
@@ -0,0 +1,82 @@
+from pydantic_settings import BaseSettings, SettingsConfigDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Literal, Optional
+
+class Settings(BaseSettings):
+    # Every field maps to the upper case environment variable of the same name, see template.env
+    model_config = SettingsConfigDict(
+        env_file=Path(__file__).resolve().parent.parent / ".env",
+        extra="ignore",
+    )
+
+    # Connection settings and secrets are optional here and checked by require() on first use,
+    # so importing the app or a worker does not need them
+    db_user: Optional[str] = None
+    db_password: Optional[str] = None
+    db_location: Optional[str] = None
+    db_port: Optional[int] = None
+    db_name: Optional[str] = None
+
+    # Optional read replica, any unset field falls back to the primary's value
+    db_replica_location: Optional[str] = None
+    db_replica_port: Optional[int] = None
+    db_replica_user: Optional[str] = None
+    db_replica_password: Optional[str] = None
+    db_replica_name: Optional[str] = None
+
+    redis_host: Optional[str] = None
+    redis_port: Optional[int] = None
+    redis_username: Optional[str] = None
+    redis_password: Optional[str] = None
+    redis_db: Optional[int] = None
+
+    fernet_key: Optional[str] = None
+    api_key_pepper: Optional[str] = None
+    sendgrid_key: Optional[str] = None
+
+    # Pool sizing is per process, each uvicorn worker and Celery child gets its own pool
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    db_statement_cache_size: int = 100
+
+    auth_cache_size: int = 10000
+    auth_cache_ttl: float = 60
+    # The API key cache only runs with the shared Redis tier, AUTH_CACHE_REDIS=0 turns it off
+    auth_cache_redis: bool = True
+    # Reads for an API key stay on the primary this long after it writes, longer than the replica lag
+    sticky_primary_seconds: float = 5
+
+    password_executor: Literal["process", "thread"] = "process"
+    password_workers: int = 2
+    password_queue_size: int = 32
+    crypto_workers: int = 4
+    # Counts bulk encrypt/decrypt calls in flight, the chunks of one call queue on the pool
+    crypto_queue_size: int = 256
+    crypto_chunk_size: int = 64
+    # Smaller bulk requests encrypt inline, the thread pool hand-off costs more than it saves
+    bulk_crypto_threshold: int = 32
+    capsule_stream_batch_size: int = 200
+
+    mail_transport: Literal["sendgrid", "file", "memory"] = "sendgrid"
+    mail_file_path: str = "outbox.jsonl"
+    send_batch_size: int = 100
+    send_concurrency: int = 10
+
+    # Set RELEASE_SCHEDULER=1 when the app.scheduler service is running
+    release_scheduler: bool = False
+    scheduler_horizon: float = 3600
+
+    def require(self, name: str):
+        value = getattr(self, name)
+        if value is None or value == "":
+            raise ValueError(f"{name.upper()} is missing from .env.")
+        return value
+
+# Read and validated once per process, use as a FastAPI dependency or call directly
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    return Settings()
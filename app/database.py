@@ -1,46 +1,159 @@
-from os import environ
-from dotenv import load_dotenv
+from app.config import get_settings
+
 from sqlmodel import SQLModel
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker
-from typing import AsyncGenerator
-
-load_dotenv()
-
-def getenv(config: str) -> str:
-    value = environ.get(config)
-    if not value:
-        raise ValueError(f"{config} is missing from .env.")
-    return value
-
-DB_USER = getenv("DB_USER")
-DB_PASSWORD = getenv("DB_PASSWORD")
-DB_LOCATION = getenv("DB_LOCATION")
-DB_PORT = getenv("DB_PORT")
-DB_NAME = getenv("DB_NAME")
-
-# Use asyncpg driver for async Postgres
-DATABASE_URL = (
-    f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}"
-    f"@{DB_LOCATION}:{DB_PORT}/{DB_NAME}"
-)
-
-# Create async engine
-engine = create_async_engine(
-    DATABASE_URL,
-    echo=False,
-    future=True
-)
-
-# Async session factory
-async_session = sessionmaker(
-    engine,
-    class_=AsyncSession,
-    expire_on_commit=False
-)
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from typing import AsyncGenerator, Dict, Optional
+import time
+
+def database_url(user: str, password: str, location: str, port: int, name: str) -> str:
+    # Use asyncpg driver for async Postgres
+    return (
+        f"postgresql+asyncpg://{user}:{password}"
+        f"@{location}:{port}/{name}"
+    )
+
+class MetricsPool(AsyncAdaptedQueuePool):
+    # Records how long callers wait for a connection, the rest comes from the pool itself
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.timeouts = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            self.waits += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+def create_engine(url: str):
+    settings = get_settings()
+    return create_async_engine(
+        url,
+        echo=False,
+        future=True,
+        poolclass=MetricsPool,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=settings.db_pool_pre_ping,
+        connect_args={
+            "statement_cache_size": settings.db_statement_cache_size,
+            "prepared_statement_cache_size": settings.db_statement_cache_size,
+        }
+    )
+
+def instrument(target) -> Dict[str, int]:
+    counters = {
+        "connects": 0,
+        "checkouts": 0,
+        "checkins": 0,
+        "invalidations": 0,
+    }
+
+    @event.listens_for(target.sync_engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        counters["connects"] += 1
+
+    @event.listens_for(target.sync_engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        counters["checkouts"] += 1
+
+    @event.listens_for(target.sync_engine, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        counters["checkins"] += 1
+
+    @event.listens_for(target.sync_engine, "invalidate")
+    def _on_invalidate(dbapi_connection, connection_record, exception):
+        counters["invalidations"] += 1
+
+    return counters
+
+# Engines are built on first use, so importing the app needs neither the DB settings nor a pool
+_engines: Dict[str, AsyncEngine] = {}
+pool_events: Dict[str, Dict[str, int]] = {}
+
+def _add_engine(name: str, url: str) -> AsyncEngine:
+    _engines[name] = create_engine(url)
+    pool_events[name] = instrument(_engines[name])
+    return _engines[name]
+
+def get_engine() -> AsyncEngine:
+    if "primary" not in _engines:
+        settings = get_settings()
+        _add_engine("primary", database_url(
+            settings.require("db_user"),
+            settings.require("db_password"),
+            settings.require("db_location"),
+            settings.require("db_port"),
+            settings.require("db_name")
+        ))
+    return _engines["primary"]
+
+def get_replica_engine() -> Optional[AsyncEngine]:
+    # Optional read replica, read-only endpoints fall back to the primary when it is not configured
+    settings = get_settings()
+    if not settings.db_replica_location:
+        return None
+    if "replica" not in _engines:
+        _add_engine("replica", database_url(
+            settings.db_replica_user or settings.require("db_user"),
+            settings.db_replica_password or settings.require("db_password"),
+            settings.db_replica_location,
+            settings.db_replica_port or settings.require("db_port"),
+            settings.db_replica_name or settings.require("db_name")
+        ))
+    return _engines["replica"]
+
+def engines() -> Dict[str, AsyncEngine]:
+    # Only the engines created so far
+    return dict(_engines)
+
+def pool_stats(name: str = "primary") -> Dict[str, float]:
+    pool = _engines[name].sync_engine.pool
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": max(0, pool.overflow()),
+        "waits": pool.waits,
+        "wait_seconds_total": pool.wait_seconds,
+        "wait_seconds_max": pool.max_wait_seconds,
+        "timeouts": pool.timeouts,
+        **pool_events[name],
+    }
+
+def reset_engines_after_fork() -> None:
+    # Pooled connections inherited from the parent belong to another process and event loop
+    for target in _engines.values():
+        target.sync_engine.dispose(close=False)
+
+async def dispose_engines() -> None:
+    for target in _engines.values():
+        await target.dispose()
+    _engines.clear()
+    pool_events.clear()
+
+# Async session factories
+def async_session() -> AsyncSession:
+    return AsyncSession(get_engine(), expire_on_commit=False)
+
+def async_read_session() -> AsyncSession:
+    return AsyncSession(get_replica_engine() or get_engine(), expire_on_commit=False)
 
 # Async dependency for FastAPI
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
     async with async_session() as session:
         yield session
-
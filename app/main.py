@@ -1,17 +1,36 @@
 from app.users.routers import router as user_router
 from app.capsules.routers import router as capsule_router
+from app.database import dispose_engines
+from app.utils.emailing import close_transport
+from app.utils.executors import password_executor, crypto_executor
+from app.utils.metrics import MetricsMiddleware
+
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 from fastapi import FastAPI, Request, status
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi.responses import JSONResponse, RedirectResponse, Response
 from fastapi.openapi.docs import get_swagger_ui_html
+from contextlib import asynccontextmanager
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Engines, the mail transport and executors are all created on first use, shutdown closes whichever exist
+    yield
+    await dispose_engines()
+    await close_transport()
+    password_executor.shutdown()
+    crypto_executor.shutdown()
 
 app = FastAPI(
     title="Time Capsule Journal",
     description="A personal project aimed at providing a modern alternative to the antiquated art of journalling.\n\nGitHub Repo: https://github.com/Syzygicality/time-capsule-journal",
     version="1.0.0",
     docs_url=None,
+    lifespan=lifespan,
 )
 
+app.add_middleware(MetricsMiddleware)
+
 @app.get("/", include_in_schema=False)
 async def root():
     return RedirectResponse(url="/docs")
@@ -26,6 +45,10 @@ async def custom_swagger_ui():
         }
     )
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 app.include_router(user_router)
 app.include_router(capsule_router)
 
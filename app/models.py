@@ -1,6 +1,7 @@
 from app.utils.helpers import current_time
 
 from sqlmodel import SQLModel, Field, Relationship
+from sqlalchemy import ForeignKey, Index, text
 from datetime import datetime, timedelta
 from uuid import UUID, uuid4
 from pydantic import EmailStr
@@ -13,10 +14,11 @@ class User(SQLModel, table=True):
     hashed_password: str = Field()
     email_verified: bool = Field(default=False)
 
-    verification: Optional["Verification"] = Relationship(back_populates="user", sa_relationship_kwargs={"uselist": False})
-    api_key: Optional["APIKey"] = Relationship(back_populates="user", sa_relationship_kwargs={"uselist": False})
-    capsules: List["Capsule"] = Relationship(back_populates="user")
-    conversations: List["Conversation"] = Relationship(back_populates="user")
+    # The foreign keys cascade, so deleting a user leaves its rows to the database instead of loading and nulling them
+    verification: Optional["Verification"] = Relationship(back_populates="user", sa_relationship_kwargs={"uselist": False, "passive_deletes": True})
+    api_keys: List["APIKey"] = Relationship(back_populates="user", sa_relationship_kwargs={"passive_deletes": True})
+    capsules: List["Capsule"] = Relationship(back_populates="user", sa_relationship_kwargs={"passive_deletes": True})
+    conversations: List["Conversation"] = Relationship(back_populates="user", sa_relationship_kwargs={"passive_deletes": True})
 
 class Verification(SQLModel, table=True):
     id: UUID = Field(primary_key=True, default_factory=uuid4)
@@ -29,15 +31,32 @@ class Verification(SQLModel, table=True):
     user: "User" = Relationship(back_populates="verification")
 
 class APIKey(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_apikey_user_id_name", "user_id", "name", unique=True),
+    )
+
     id: UUID = Field(primary_key=True, default_factory=uuid4)
     user_id: UUID = Field(foreign_key="user.id", ondelete="CASCADE", index=True)
-    prefix: str = Field(max_length=12, index=True)
-    hashed_key: str = Field(max_length=64, index=True)
-    salt: str = Field()
+    name: str = Field(max_length=32, default="default")
+    prefix: str = Field(max_length=12, index=True, unique=True)
+    hashed_key: str = Field(max_length=64)
+    # Only set on keys hashed before the pepper, cleared when they are rehashed
+    salt: Optional[str] = Field(default=None, nullable=True)
+    scope: str = Field(max_length=8, default="write")
+    creation_date: datetime = Field(default_factory=current_time)
+    expires_at: Optional[datetime] = Field(default=None, nullable=True)
 
-    user: "User" = Relationship(back_populates="api_key")
+    user: "User" = Relationship(back_populates="api_keys")
 
 class Capsule(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_capsule_user_id_release_date", "user_id", "release_date", "id"),
+        # Only undispatched capsules matter to the release scheduler, including id allows index-only scans
+        Index("ix_capsule_release_date_undispatched", "release_date", postgresql_where=text("sent = false AND scheduled_at IS NULL"), postgresql_include=["id"]),
+        # Lets the beat find dispatches that never got sent without scanning the table
+        Index("ix_capsule_scheduled_at_undelivered", "scheduled_at", postgresql_where=text("sent = false AND scheduled_at IS NOT NULL")),
+    )
+
     id: UUID = Field(primary_key=True, default_factory=uuid4)
     user_id: UUID = Field(foreign_key="user.id", ondelete="CASCADE", index=True)
     conversation_id: Optional[UUID] = Field(foreign_key="conversation.id", nullable=True, index=True, default=None)
@@ -47,19 +66,22 @@ class Capsule(SQLModel, table=True):
     release_date: datetime = Field()
     replying_to_id: Optional[UUID] = Field(default=None, foreign_key="capsule.id", nullable=True)
     sent: bool = Field(default=False)
+    scheduled_at: Optional[datetime] = Field(default=None, nullable=True)
 
     user: "User" = Relationship(back_populates="capsules")
-    conversation: Optional["Conversation"] = Relationship(back_populates="capsules")
+    conversation: Optional["Conversation"] = Relationship(back_populates="capsules", sa_relationship_kwargs={"foreign_keys": "Capsule.conversation_id"})
     replying_to: Optional["Capsule"] = Relationship(sa_relationship_kwargs={"remote_side": "Capsule.id"})
 
 class Conversation(SQLModel, table=True):
     id: UUID = Field(primary_key=True, default_factory=uuid4)
     user_id: UUID = Field(foreign_key="user.id", ondelete="CASCADE", index=True)
-    latest_capsule_id: UUID = Field(foreign_key="capsule.id")
+    # Capsules and conversations reference each other, naming the cycle's ALTER side keeps create_all
+    # from flagging every foreign key of both tables, which then vanish from later SQLite DDL
+    latest_capsule_id: UUID = Field(sa_column_args=[ForeignKey("capsule.id", use_alter=True)])
 
     user: "User" = Relationship(back_populates="conversations")
-    capsules: List["Capsule"] = Relationship(back_populates="conversation")
-    latest_capsule: Optional["Capsule"] = Relationship(sa_relationship_kwargs={"remote_side": "Capsule.id"})
+    capsules: List["Capsule"] = Relationship(back_populates="conversation", sa_relationship_kwargs={"foreign_keys": "Capsule.conversation_id"})
+    latest_capsule: Optional["Capsule"] = Relationship(sa_relationship_kwargs={"foreign_keys": "Conversation.latest_capsule_id"})
 
     @property
     def reply_allowed(self):
@@ -0,0 +1,116 @@
+from app.config import get_settings
+from app.database import get_engine, async_session
+from app.models import Capsule
+from app.utils.celery import send_capsules_task
+from app.utils.helpers import current_time, utc_timestamp
+from app.utils.releases import ReleaseQueue, RELEASE_CHANNEL, parse_release
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import DBAPIError
+from datetime import datetime, timezone
+from typing import List
+from uuid import UUID
+import asyncio
+import asyncpg
+import logging
+import time
+
+# python -m app.scheduler
+
+logger = logging.getLogger("app.scheduler")
+
+# Only releases within this many seconds are held in memory, later ones are loaded by the next refill
+HORIZON_SECONDS = get_settings().scheduler_horizon
+TICK_SECONDS = 1.0
+RECONNECT_SECONDS = 5.0
+
+async def catch_up(queue: ReleaseQueue, until: float) -> None:
+    async with async_session() as session:
+        result = await session.execute(
+            select(Capsule.id, Capsule.release_date)
+            .where(Capsule.sent == False)
+            .where(Capsule.scheduled_at == None)
+            .where(Capsule.release_date < datetime.fromtimestamp(until, timezone.utc))
+        )
+        for capsule_id, release_date in result.all():
+            queue.push(utc_timestamp(release_date), str(capsule_id))
+
+async def dispatch(capsule_ids: List[str]) -> List[str]:
+    # Marking the ledger first keeps the beat sweep and later refills from dispatching these again.
+    # Returns the ids that could not be enqueued, their claim is released so they can be retried.
+    claimed_at = current_time()
+    async with async_session() as session:
+        result = await session.execute(
+            update(Capsule)
+            .where(Capsule.id.in_([UUID(capsule_id) for capsule_id in capsule_ids]))
+            .where(Capsule.scheduled_at == None)
+            .values(scheduled_at=claimed_at)
+            .returning(Capsule.id)
+        )
+        claimed = [str(capsule_id) for capsule_id in result.scalars().all()]
+        await session.commit()
+    size = get_settings().send_batch_size
+    for i in range(0, len(claimed), size):
+        try:
+            await asyncio.to_thread(send_capsules_task.apply_async, args=[claimed[i:i + size]])
+        except Exception:
+            logger.exception("enqueueing %d capsules failed, releasing their claim", len(claimed) - i)
+            await release_claims(claimed[i:], claimed_at)
+            return claimed[i:]
+    if claimed:
+        logger.info("dispatched %d capsules", len(claimed))
+    return []
+
+async def release_claims(capsule_ids: List[str], claimed_at: datetime) -> None:
+    # Otherwise they would wait for DISPATCH_TIMEOUT before the beat picked them up again
+    async with async_session() as session:
+        await session.execute(
+            update(Capsule)
+            .where(Capsule.id.in_([UUID(capsule_id) for capsule_id in capsule_ids]))
+            .where(Capsule.sent == False)
+            .where(Capsule.scheduled_at == claimed_at)
+            .values(scheduled_at=None)
+        )
+        await session.commit()
+
+async def run_scheduler() -> None:
+    queue = ReleaseQueue()
+
+    def on_release(connection, pid, channel, payload):
+        capsule_id, release_at = parse_release(payload)
+        if release_at < time.time() + HORIZON_SECONDS:
+            queue.push(release_at, capsule_id)
+
+    while True:
+        connection = None
+        try:
+            connection = await asyncpg.connect(get_engine().url.set(drivername="postgresql").render_as_string(hide_password=False))
+            # Listen before catching up, so nothing committed in between is missed
+            await connection.add_listener(RELEASE_CHANNEL, on_release)
+            await catch_up(queue, time.time() + HORIZON_SECONDS)
+            next_refill = time.time() + HORIZON_SECONDS / 2
+            while not connection.is_closed():
+                now = time.time()
+                if now >= next_refill:
+                    await catch_up(queue, now + HORIZON_SECONDS)
+                    next_refill = now + HORIZON_SECONDS / 2
+                due = queue.pop_due(now)
+                if due:
+                    # A broker outage retries on the reconnect interval instead of stopping the service
+                    for capsule_id in await dispatch(due):
+                        queue.push(now + RECONNECT_SECONDS, capsule_id)
+                next_release = queue.next_release()
+                delay = TICK_SECONDS if next_release is None else min(TICK_SECONDS, next_release - time.time())
+                await asyncio.sleep(max(0.0, delay))
+        except (OSError, asyncpg.PostgresError, DBAPIError) as e:
+            # DBAPIError wraps failures of the catch_up and dispatch queries, which go through SQLAlchemy
+            logger.warning("release listener lost (%s), reconnecting", e)
+            await asyncio.sleep(RECONNECT_SECONDS)
+        finally:
+            # Drop the old listener before reconnecting, terminate does not wait on a connection that may be dead
+            if connection is not None and not connection.is_closed():
+                connection.terminate()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_scheduler())
@@ -1,11 +1,13 @@
 from app.models import User, APIKey, Verification
 from app.utils.encryption import hash_password, verify_password, hash_api_key
-from app.utils.authentication import authenticate_api_key
+from app.utils.authentication import authenticate_api_key, READ_SCOPE
+from app.utils.caching import auth_cache
 from app.utils.helpers import get_random_string, current_time
 
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from sqlmodel import select, exists
-from typing import Optional, Tuple, Dict
+from typing import Optional, Tuple, Dict, List
 from datetime import timedelta
 from fastapi import HTTPException, status
 from secrets import randbelow
@@ -17,7 +19,7 @@ async def create_user(session: AsyncSession, username: str, email: Optional[str]
     user = User(
         username=username,
         email=email,
-        hashed_password=hash_password(password)
+        hashed_password=await hash_password(password)
     )
     session.add(user)
     await session.commit() 
@@ -25,7 +27,7 @@ async def create_user(session: AsyncSession, username: str, email: Optional[str]
     return user
 
 async def retrieve_user(session: AsyncSession, api_key: str) -> User:
-    key_obj = await authenticate_api_key(session, api_key)
+    key_obj = await authenticate_api_key(session, api_key, READ_SCOPE)
     return key_obj.user
 
 async def update_user(session: AsyncSession, api_key: str, username: Optional[str], email: Optional[str],) -> Dict[str, str]:
@@ -41,6 +43,7 @@ async def update_user(session: AsyncSession, api_key: str, username: Optional[st
         user.email_verified = False
     session.add(user)
     await session.commit()
+    await auth_cache.invalidate(user.id, key_obj.prefix)
     if email:
         return {"details": "Update successful. Please verify your new email."}
     return {"details": "Update successful"}
@@ -48,18 +51,22 @@ async def update_user(session: AsyncSession, api_key: str, username: Optional[st
 async def update_user_password(session: AsyncSession, api_key: str, old_password: str, new_password: str) -> User:
     key_obj = await authenticate_api_key(session, api_key)
     user = key_obj.user
-    if not verify_password(old_password, user.hashed_password):
+    # Cached users are rebuilt without the password hash
+    await session.refresh(user, ["hashed_password"])
+    if not await verify_password(old_password, user.hashed_password):
         raise HTTPException(detail="Password given is incorrect.", status_code=status.HTTP_400_BAD_REQUEST)
-    user.hashed_password = hash_password(new_password)
+    user.hashed_password = await hash_password(new_password)
     session.add(user)
     await session.commit()
+    await auth_cache.invalidate(user.id, key_obj.prefix)
     return user
 
 async def destroy_user(session: AsyncSession, api_key: str) -> dict[str]:
     key_obj = await authenticate_api_key(session, api_key)
     user = key_obj.user
-    session.delete(user)
+    await session.delete(user)
     await session.commit()
+    await auth_cache.invalidate(user.id)
     return {"details": "Account successfully deleted."}
 
 async def create_verification(session: AsyncSession, api_key: str) -> Tuple[str, str]:
@@ -98,52 +105,81 @@ async def delete_verification(session: AsyncSession, api_key: str, code: int) ->
         raise HTTPException(detail="Too many incorrect attempts, please request another.", status_code=status.HTTP_429_TOO_MANY_REQUESTS)
     if verification.code == code:
         user.email_verified = True
-        session.delete(verification)
+        await session.delete(verification)
         await session.commit()
+        await auth_cache.invalidate(user.id, key_obj.prefix)
         return {"details": "Your email has be verified."}
     else:
         verification.attempts += 1
         await session.commit()
         raise HTTPException(detail=f"Incorrect verification code. ({verification.attempts} / 3)", status_code=status.HTTP_400_BAD_REQUEST)
 
-async def create_api_key(session: AsyncSession, username: str, password: str) -> tuple[APIKey, str]:
-    user = await session.execute(select(User).where(User.username == username)).first()
+MAX_API_KEYS = 10
+
+async def authenticate_user(session: AsyncSession, username: str, password: str) -> User:
+    result = await session.execute(select(User).options(selectinload(User.api_keys)).where(User.username == username))
+    user = result.scalars().first()
     if not user:
         raise HTTPException(detail="Username given does not exist.", status_code=status.HTTP_404_NOT_FOUND)
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password(password, user.hashed_password):
         raise HTTPException(detail="Password given is incorrect.", status_code=status.HTTP_400_BAD_REQUEST)
-    if user.api_key:
-        raise HTTPException(detail="Your API key already exists. If you have lost/forgotten your key, you can regenerate a new key.", status_code=status.HTTP_400_BAD_REQUEST)
+    return user
+
+async def create_api_key(session: AsyncSession, username: str, password: str, name: str, scope: str, expires_in: Optional[timedelta]) -> tuple[APIKey, str]:
+    user = await authenticate_user(session, username, password)
+    if any(key_obj.name == name for key_obj in user.api_keys):
+        raise HTTPException(detail=f"An API key named '{name}' already exists. If you have lost/forgotten it, you can regenerate it.", status_code=status.HTTP_400_BAD_REQUEST)
+    if len(user.api_keys) >= MAX_API_KEYS:
+        raise HTTPException(detail=f"You can have at most {MAX_API_KEYS} API keys, delete one before creating another.", status_code=status.HTTP_400_BAD_REQUEST)
     prefix = get_random_string(12)
     raw_key = get_random_string(48)
-    hashed_key, salt = hash_api_key(raw_key)
     key_obj = APIKey(
         user_id=user.id,
+        name=name,
         prefix=prefix,
-        hashed_key=hashed_key,
-        salt=salt
+        hashed_key=hash_api_key(raw_key),
+        scope=scope,
+        expires_at=current_time() + expires_in if expires_in else None
     )
     session.add(key_obj)
     await session.commit()
-    await session.refresh(key_obj)
     return key_obj, prefix + "-" + raw_key
 
-async def update_api_key(session: AsyncSession, username: str, password: str) -> tuple[APIKey, str]:
-    user = await session.execute(select(User).where(User.username == username)).first()
-    if not user:
-        raise HTTPException(detail="Username given does not exist.", status_code=status.HTTP_404_NOT_FOUND)
-    if not verify_password(password, user.hashed_password):
-        raise HTTPException(detail="Password given is incorrect.", status_code=status.HTTP_400_BAD_REQUEST)
-    if not user.api_key:
-        raise HTTPException(detail="Your API key does not exist. You have to create your key before you can regenerate a new key.", status_code=status.HTTP_400_BAD_REQUEST)
-    key_obj = user.api_key
+async def update_api_key(session: AsyncSession, username: str, password: str, name: str) -> tuple[APIKey, str]:
+    # Rotates one key, the user's other keys keep working
+    user = await authenticate_user(session, username, password)
+    key_obj = next((key_obj for key_obj in user.api_keys if key_obj.name == name), None)
+    if not key_obj:
+        raise HTTPException(detail=f"No API key named '{name}' exists. You have to create your key before you can regenerate a new key.", status_code=status.HTTP_400_BAD_REQUEST)
+    old_prefix = key_obj.prefix
     prefix = get_random_string(12)
     raw_key = get_random_string(48)
     key_obj.prefix = prefix
-    key_obj.hashed_key, key_obj.salt = hash_api_key(raw_key)
+    key_obj.hashed_key = hash_api_key(raw_key)
+    key_obj.salt = None
     session.add(key_obj)
     await session.commit()
+    await auth_cache.invalidate(user.id, old_prefix)
     return key_obj, prefix + "-" + raw_key
 
+async def list_api_keys(session: AsyncSession, api_key: str) -> Dict[str, List[APIKey]]:
+    key_obj = await authenticate_api_key(session, api_key, READ_SCOPE)
+    result = await session.execute(select(APIKey)
+                                   .where(APIKey.user_id == key_obj.user_id)
+                                   .order_by(APIKey.creation_date))
+    return {
+        "keys": result.scalars().all(),
+    }
 
-
+async def destroy_api_key(session: AsyncSession, api_key: str, name: str) -> Dict[str, str]:
+    key_obj = await authenticate_api_key(session, api_key)
+    result = await session.execute(select(APIKey)
+                                   .where(APIKey.user_id == key_obj.user_id)
+                                   .where(APIKey.name == name))
+    target = result.scalars().first()
+    if not target:
+        raise HTTPException(detail=f"No API key named '{name}' exists.", status_code=status.HTTP_404_NOT_FOUND)
+    await session.delete(target)
+    await session.commit()
+    await auth_cache.invalidate(key_obj.user_id, target.prefix)
+    return {"details": f"API key '{name}' deleted."}
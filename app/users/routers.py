@@ -3,7 +3,9 @@ from app.users.schemas import (
     UserUpdateSchema, 
     UserSchema, 
     APIKeyCreateSchema, 
+    APIKeyRotateSchema,
     APIKeySchema,
+    APIKeyListSchema,
     UserPasswordResetSchema
 )
 
@@ -17,10 +19,13 @@ from app.users.crud import (
     delete_verification,
     create_api_key,
     update_api_key,
+    list_api_keys,
+    destroy_api_key,
 )
 
 from app.database import get_db
 from app.utils.authentication import access_api_key
+from app.utils.routing import get_read_db, sticky_primary
 from app.utils.emailing import send_verification_email
 
 from fastapi import APIRouter, Depends, BackgroundTasks
@@ -29,7 +34,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 router = APIRouter(prefix="/users", tags=["User Management"])
 
 @router.get("/me", response_model=UserSchema)
-async def get_user(api_key: str = Depends(access_api_key), session: AsyncSession = Depends(get_db)):
+async def get_user(api_key: str = Depends(access_api_key), session: AsyncSession = Depends(get_read_db)):
     return await retrieve_user(
         session,
         api_key
@@ -46,21 +51,25 @@ async def post_user(user_data: UserCreateSchema, session: AsyncSession = Depends
 
 @router.patch("/me", response_model=UserSchema)
 async def patch_user(user_data: UserUpdateSchema, api_key: str = Depends(access_api_key), session: AsyncSession = Depends(get_db)):
-    return await update_user(
+    user = await update_user(
         session,
         api_key,
         user_data.username,
         user_data.email
     )
+    await sticky_primary.mark(api_key)
+    return user
 
 @router.post("/me/change-password", response_model=UserSchema)
 async def change_user_password(user_data: UserPasswordResetSchema, api_key: str = Depends(access_api_key), session: AsyncSession = Depends(get_db)):
-    return await update_user_password(
+    user = await update_user_password(
         session,
         api_key,
         user_data.old_password,
         user_data.new_password
     )
+    await sticky_primary.mark(api_key)
+    return user
 
 @router.delete("/me")
 async def delete_user(api_key: str = Depends(access_api_key), session: AsyncSession = Depends(get_db)):
@@ -84,26 +93,51 @@ async def request_email_verification(background_tasks: BackgroundTasks, api_key:
 
 @router.post("/verify")
 async def send_verification_code(code: int, api_key: str = Depends(access_api_key), session: AsyncSession = Depends(get_db)):
-    return await delete_verification(
+    response = await delete_verification(
         session,
         api_key,
         code
     )
+    await sticky_primary.mark(api_key)
+    return response
+
+@router.get("/api-key", response_model=APIKeyListSchema)
+async def get_api_key_list(api_key: str = Depends(access_api_key), session: AsyncSession = Depends(get_read_db)):
+    return await list_api_keys(
+        session,
+        api_key
+    )
 
 @router.post("/api-key/create", response_model=APIKeySchema)
 async def generate_api_key(user_data: APIKeyCreateSchema, session: AsyncSession = Depends(get_db)):
     key_obj, raw_key = await create_api_key(
         session,
         user_data.username,
-        user_data.password
+        user_data.password,
+        user_data.name,
+        user_data.scope,
+        user_data.expires_in
     )
+    # The new key may not have reached the replica yet
+    await sticky_primary.mark(raw_key)
     return {"key": raw_key}
 
 @router.post("/api-key/regen", response_model=APIKeySchema)
-async def regenerate_api_key(user_data: APIKeyCreateSchema, session: AsyncSession = Depends(get_db)):
+async def regenerate_api_key(user_data: APIKeyRotateSchema, session: AsyncSession = Depends(get_db)):
     key_obj, raw_key = await update_api_key(
         session,
         user_data.username,
-        user_data.password
+        user_data.password,
+        user_data.name
+    )
+    # The new key may not have reached the replica yet
+    await sticky_primary.mark(raw_key)
+    return {"key": raw_key}
+
+@router.delete("/api-key/{name}")
+async def delete_api_key(name: str, api_key: str = Depends(access_api_key), session: AsyncSession = Depends(get_db)):
+    return await destroy_api_key(
+        session,
+        api_key,
+        name
     )
-    return {"key": raw_key}
\ No newline at end of file
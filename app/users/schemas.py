@@ -1,6 +1,8 @@
 from sqlmodel import Field
 from pydantic import BaseModel, EmailStr, model_validator
 from typing_extensions import Self
+from typing import List, Literal
+from datetime import datetime, timedelta
 
 class UserCreateSchema(BaseModel):
     username: str = Field(min_length=3, max_length=32)
@@ -72,6 +74,30 @@ class UserSchema(BaseModel):
 class APIKeyCreateSchema(BaseModel):
     username: str
     password: str
+    name: str = Field(default="default", min_length=1, max_length=32)
+    scope: Literal["read", "write"] = "write"
+    expires_in: timedelta | None = None
+
+    @model_validator(mode="after")
+    def expiry_check(self) -> Self:
+        if self.expires_in is not None and self.expires_in <= timedelta(0):
+            raise ValueError("The expiry must be in the future.")
+        return self
+
+class APIKeyRotateSchema(BaseModel):
+    username: str
+    password: str
+    name: str = Field(default="default", min_length=1, max_length=32)
+
+class APIKeyInfoSchema(BaseModel):
+    name: str
+    prefix: str
+    scope: str
+    creation_date: datetime
+    expires_at: datetime | None
+
+class APIKeyListSchema(BaseModel):
+    keys: List[APIKeyInfoSchema]
 
 class APIKeySchema(BaseModel):
     key: str
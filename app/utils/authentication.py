@@ -1,20 +1,68 @@
+from app.database import async_session
 from app.models import APIKey
-from app.utils.encryption import verify_api_key
+from app.utils.encryption import hash_api_key, verify_api_key
+from app.utils.caching import auth_cache
+from app.utils.helpers import utc_timestamp
+from app.utils.metrics import timed
 
 from fastapi import Header, HTTPException, status
 from sqlmodel import select
+from sqlalchemy import update
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.attributes import set_committed_value
+from typing import Optional
+import time
+
+READ_SCOPE = "read"
+WRITE_SCOPE = "write"
 
 async def access_api_key(api_key: str = Header(...)):
     if not api_key:
         raise HTTPException(detail="API key credential were not provided.", status_code=status.HTTP_401_UNAUTHORIZED)
     return api_key
 
-async def authenticate_api_key(session: AsyncSession, api_key: str) -> APIKey:
+async def rehash_api_key(key_obj: APIKey, secret: str) -> None:
+    # Moves a salted legacy key to the peppered HMAC. Runs on its own primary session since
+    # the request may be reading from a replica, and only applies if the row still holds the old hash.
+    hashed_key = hash_api_key(secret)
+    async with async_session() as session:
+        await session.execute(update(APIKey)
+                              .where(APIKey.id == key_obj.id)
+                              .where(APIKey.hashed_key == key_obj.hashed_key)
+                              .values(hashed_key=hashed_key, salt=None))
+        await session.commit()
+    set_committed_value(key_obj, "hashed_key", hashed_key)
+    set_committed_value(key_obj, "salt", None)
+
+def check_key(scope: str, key_scope: str, key_expires_at: Optional[float]) -> None:
+    if key_expires_at is not None and key_expires_at <= time.time():
+        raise HTTPException(detail="Invalid/expired API key given.", status_code=status.HTTP_401_UNAUTHORIZED)
+    if scope == WRITE_SCOPE and key_scope != WRITE_SCOPE:
+        raise HTTPException(detail="This API key is read-only.", status_code=status.HTTP_403_FORBIDDEN)
+
+@timed("authenticate_api_key")
+async def authenticate_api_key(session: AsyncSession, api_key: str, scope: str = WRITE_SCOPE) -> APIKey:
     exploded_key = api_key.split("-")
     if len(exploded_key) != 2:
         raise HTTPException(detail="Invalid API key format.", status_code=status.HTTP_401_UNAUTHORIZED)
-    key_obj = await session.exec(select(APIKey).where(APIKey.prefix == exploded_key[0])).first()
+    entry = await auth_cache.get(exploded_key[0])
+    if entry:
+        if not verify_api_key(exploded_key[1], entry.hashed_key, entry.salt):
+            raise HTTPException(detail="Invalid/expired API key given.", status_code=status.HTTP_401_UNAUTHORIZED)
+        check_key(scope, entry.scope, entry.key_expires_at)
+        return await entry.attach(session)
+    # Read before the query so an invalidation racing the load keeps the stale row out of the cache
+    generation = await auth_cache.generation()
+    result = await session.execute(select(APIKey)
+                                   .options(joinedload(APIKey.user))
+                                   .where(APIKey.prefix == exploded_key[0]))
+    key_obj = result.scalars().first()
     if not key_obj or not verify_api_key(exploded_key[1], key_obj.hashed_key, key_obj.salt):
         raise HTTPException(detail="Invalid/expired API key given.", status_code=status.HTTP_401_UNAUTHORIZED)
-    return key_obj
\ No newline at end of file
+    if key_obj.salt is not None:
+        await rehash_api_key(key_obj, exploded_key[1])
+    # Checked before caching so an expired key never enters the cache
+    check_key(scope, key_obj.scope, utc_timestamp(key_obj.expires_at) if key_obj.expires_at else None)
+    await auth_cache.set(key_obj, key_obj.user, generation)
+    return key_obj
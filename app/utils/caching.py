@@ -0,0 +1,253 @@
+from app.config import get_settings
+from app.models import APIKey, User
+from app.utils.helpers import utc_timestamp
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from functools import lru_cache
+from typing import Any, Dict, Optional
+from urllib.parse import quote
+from uuid import UUID
+import json
+import time
+
+@dataclass
+class AuthCacheEntry:
+    hashed_key: str
+    salt: Optional[str]
+    key: Dict[str, Any]
+    user: Dict[str, Any]
+    version: int
+    expires_at: float
+    # Copied out of the key so scope and expiry checks need neither a query nor a model rebuild
+    scope: str = "write"
+    key_expires_at: Optional[float] = None
+
+    @property
+    def user_id(self) -> str:
+        return str(self.user["id"])
+
+    async def attach(self, session: AsyncSession) -> APIKey:
+        # Rebuild the snapshot as detached rows and merge them without a SELECT
+        # The snapshot has no password hash, it stays expired and is loaded only where needed
+        user = User.model_validate({**self.user, "hashed_password": ""})
+        key_obj = APIKey.model_validate(self.key)
+        make_transient_to_detached(user)
+        make_transient_to_detached(key_obj)
+        user = await session.merge(user, load=False)
+        session.expire(user, ["hashed_password"])
+        key_obj = await session.merge(key_obj, load=False)
+        set_committed_value(key_obj, "user", user)
+        return key_obj
+
+class SharedAuthCache:
+    # Redis tier shared by every worker. Entries carry the user's version at write time,
+    # bumping the version invalidates every entry (and every worker's local copy) for that user.
+    # The generation counts every invalidation, an entry is only stored if none happened while it was loaded.
+    GENERATION_KEY = "auth:generation"
+
+    def __init__(self, client: Optional[Redis], ttl: float):
+        # Without a client the shared Redis from get_redis() is used, created on first use
+        self._client = client
+        self.ttl = ttl
+
+    @property
+    def client(self) -> Redis:
+        return self._client if self._client is not None else get_redis()
+
+    @staticmethod
+    def _entry_key(prefix: str) -> str:
+        return f"auth:key:{prefix}"
+
+    @staticmethod
+    def _version_key(user_id: str) -> str:
+        return f"auth:user:{user_id}:version"
+
+    async def version(self, user_id: str) -> int:
+        return int(await self.client.get(self._version_key(user_id)) or 0)
+
+    async def generation(self) -> int:
+        return int(await self.client.get(self.GENERATION_KEY) or 0)
+
+    async def version_since(self, user_id: str, generation: int) -> Optional[int]:
+        # The user's current version, or None if anything was invalidated after generation was read
+        version, current = await self.client.mget(self._version_key(user_id), self.GENERATION_KEY)
+        if int(current or 0) != generation:
+            return None
+        return int(version or 0)
+
+    async def get(self, prefix: str) -> Optional[AuthCacheEntry]:
+        raw = await self.client.get(self._entry_key(prefix))
+        if not raw:
+            return None
+        entry = AuthCacheEntry(**json.loads(raw))
+        if entry.version != await self.version(entry.user_id):
+            return None
+        return entry
+
+    async def set(self, prefix: str, entry: AuthCacheEntry) -> None:
+        await self.client.set(self._entry_key(prefix), json.dumps(asdict(entry)), ex=max(1, int(self.ttl)))
+
+    async def invalidate(self, user_id: str) -> None:
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.incr(self._version_key(user_id))
+            pipe.incr(self.GENERATION_KEY)
+            await pipe.execute()
+
+class AuthCache:
+    def __init__(self, maxsize: int, ttl: float, shared: Optional[SharedAuthCache] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.shared = shared
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, AuthCacheEntry] = OrderedDict()
+
+    async def get(self, prefix: str) -> Optional[AuthCacheEntry]:
+        entry = self._get_local(prefix)
+        if entry and self.shared:
+            try:
+                if entry.version != await self.shared.version(entry.user_id):
+                    self._entries.pop(prefix, None)
+                    entry = None
+            except RedisError:
+                pass
+        if entry:
+            self.hits += 1
+            return entry
+        if self.shared:
+            try:
+                entry = await self.shared.get(prefix)
+            except RedisError:
+                entry = None
+            if entry:
+                self._set_local(prefix, entry)
+                self.shared_hits += 1
+                return entry
+        self.misses += 1
+        return None
+
+    async def generation(self) -> Optional[int]:
+        # Read before loading a key from the database and passed to set()
+        if not self.shared:
+            return None
+        try:
+            return await self.shared.generation()
+        except RedisError:
+            return None
+
+    async def set(self, key_obj: APIKey, user: User, generation: Optional[int] = None) -> None:
+        version = 0
+        if self.shared:
+            if generation is None:
+                return
+            try:
+                version = await self.shared.version_since(str(user.id), generation)
+            except RedisError:
+                return
+            # Invalidated while the key was being loaded, the row may already be stale
+            if version is None:
+                return
+        entry = AuthCacheEntry(
+            hashed_key=key_obj.hashed_key,
+            salt=key_obj.salt,
+            key=key_obj.model_dump(mode="json"),
+            # The password hash never leaves the database, Redis is shared with Celery
+            user=user.model_dump(mode="json", exclude={"hashed_password"}),
+            version=version,
+            expires_at=time.time() + self.ttl,
+            scope=key_obj.scope,
+            key_expires_at=utc_timestamp(key_obj.expires_at) if key_obj.expires_at else None
+        )
+        self._set_local(key_obj.prefix, entry)
+        if self.shared:
+            try:
+                await self.shared.set(key_obj.prefix, entry)
+            except RedisError:
+                pass
+
+    async def invalidate(self, user_id: UUID, prefix: Optional[str] = None) -> None:
+        if prefix:
+            self._entries.pop(prefix, None)
+        else:
+            for cached_prefix, entry in list(self._entries.items()):
+                if entry.user_id == str(user_id):
+                    del self._entries[cached_prefix]
+        if self.shared:
+            try:
+                await self.shared.invalidate(str(user_id))
+            except RedisError:
+                pass
+
+    def peek(self, prefix: str) -> Optional[AuthCacheEntry]:
+        # Local lookup only, without touching the hit counters or Redis
+        return self._get_local(prefix)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+        }
+
+    def _get_local(self, prefix: str) -> Optional[AuthCacheEntry]:
+        entry = self._entries.get(prefix)
+        if entry and entry.expires_at > time.time():
+            self._entries.move_to_end(prefix)
+            return entry
+        if entry:
+            del self._entries[prefix]
+        return None
+
+    def _set_local(self, prefix: str, entry: AuthCacheEntry) -> None:
+        if self.maxsize <= 0:
+            return
+        self._entries[prefix] = entry
+        self._entries.move_to_end(prefix)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+def redis_url() -> str:
+    # Username and password are optional, a server without ACLs takes a password alone
+    settings = get_settings()
+    credentials = quote(settings.redis_username or "", safe="")
+    if settings.redis_password:
+        credentials += ":" + quote(settings.redis_password, safe="")
+    if credentials:
+        credentials += "@"
+    return f"rediss://{credentials}{settings.require('redis_host')}:{settings.require('redis_port')}/{settings.require('redis_db')}"
+
+def shared_redis_enabled() -> bool:
+    settings = get_settings()
+    return settings.auth_cache_redis and bool(settings.redis_host)
+
+@lru_cache(maxsize=None)
+def get_redis() -> Optional[Redis]:
+    # Built on first use rather than at import, so an incomplete REDIS_* config fails the requests
+    # that need Redis instead of importing the app
+    if not shared_redis_enabled():
+        return None
+    return Redis.from_url(redis_url())
+
+settings = get_settings()
+
+# Entries are shared through the Celery Redis whenever it is configured, so a key that is regenerated,
+# deleted or expires stops working on every worker at once. Without Redis each worker could keep
+# accepting a revoked key until its local copy expired, so caching is off entirely.
+shared_auth_cache = SharedAuthCache(None, settings.auth_cache_ttl) if shared_redis_enabled() else None
+
+auth_cache = AuthCache(
+    maxsize=settings.auth_cache_size if shared_auth_cache is not None else 0,
+    ttl=settings.auth_cache_ttl,
+    shared=shared_auth_cache
+)
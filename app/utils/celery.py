@@ -1,82 +1,141 @@
-from app.database import getenv
+from app.config import get_settings
 from app.models import Capsule
-from app.database import get_db
+from app.database import async_session, reset_engines_after_fork
+from app.utils.caching import redis_url
 from app.utils.helpers import current_time
-from app.utils.emailing import send_capsule_email, send_conversation_email
+from app.utils.emailing import render_capsule_email, render_conversation_email, send_messages
+from app.capsules.crud import load_thread
 
 from celery import Celery
 from celery.schedules import crontab
-from datetime import timedelta
-from sqlalchemy import select
+from celery.signals import worker_process_init
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+from sqlalchemy.orm import joinedload
+from typing import Coroutine, List, Optional
+from itertools import groupby
 import asyncio
 
 
-REDIS_HOST = getenv("REDIS_HOST")
-REDIS_PORT = getenv("REDIS_PORT")
-REDIS_USERNAME = getenv("REDIS_USERNAME")
-REDIS_PASSWORD = getenv("REDIS_PASSWORD")
-REDIS_DB = getenv("REDIS_DB")
+class CeleryConfig:
+    # Read when Celery first needs its configuration, so importing this module needs no Redis settings
+    task_ignore_result = True
 
+    # With the release scheduler running, the beat only sweeps up capsules it missed
+    beat_schedule = {
+        "process-pending-capsules": {
+            "task": "app.utils.celery.process_pending_capsules",
+            "schedule": crontab(minute="*/30") if get_settings().release_scheduler else crontab(minute="*/5"),
+        }
+    }
 
-celery_app = Celery(
-    "worker",
-    broker=f"rediss://{REDIS_USERNAME}:{REDIS_PASSWORD}@{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}",
-)
-
-celery_app.conf.update(
-    task_ignore_result=True
-)
+    @property
+    def broker_url(self) -> str:
+        return redis_url()
 
-celery_app.conf.beat_schedule = {
-    "process-pending-capsules-every-5-minutes": {
-        "task": "app.tasks.process_pending_capsules",
-        "schedule": crontab(minute="*/5"),
-    }
-}
+celery_app = Celery("worker")
+celery_app.config_from_object(CeleryConfig())
 
 # celery -A app.celery_app worker -B --loglevel=info
 
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+@worker_process_init.connect
+def _init_worker_process(**kwargs):
+    reset_engines_after_fork()
+
+def run_async(coro: Coroutine):
+    # One long-lived loop per worker process, so pooled asyncpg connections stay usable between tasks
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_loop)
+    return _loop.run_until_complete(coro)
+
+async def send_released_capsules(capsule_ids: Optional[List[str]] = None) -> int:
+    async with async_session() as session:
+        # SKIP LOCKED lets several workers drain the same release burst without double sending
+        stmt = (
+            select(Capsule)
+            .options(joinedload(Capsule.user, innerjoin=True))
+            .where(Capsule.sent == False)
+            .where(Capsule.release_date <= current_time() + timedelta(seconds=1))
+            .order_by(Capsule.release_date.asc())
+            .limit(get_settings().send_batch_size)
+            .with_for_update(skip_locked=True, of=Capsule)
+        )
+        if capsule_ids is not None:
+            stmt = stmt.where(Capsule.id.in_(capsule_ids))
+        result = await session.execute(stmt)
+        capsules = result.scalars().all()
+        if not capsules:
+            return 0
+
+        messages = []
+        for capsule in capsules:
+            if capsule.conversation_id:
+                messages.append(render_conversation_email(capsule.user.email, await load_thread(session, capsule.id)))
+            else:
+                messages.append(render_capsule_email(capsule.user.email, capsule))
+
+        results = await send_messages(messages)
+        sent_ids = [capsule.id for capsule, sent in zip(capsules, results) if sent]
+        if sent_ids:
+            await session.execute(update(Capsule).where(Capsule.id.in_(sent_ids)).values(sent=True))
+        await session.commit()
+        return len(sent_ids)
 
 @celery_app.task(bind=True)
-def send_capsule_task(self, capsule_id: str):
-
-    async def _send():
-        async with get_db() as session:
-            capsule: Capsule = await session.get(Capsule, capsule_id)
-            if not capsule or capsule.sent:
-                return
-
-            try:
-                if capsule.conversation:
-                    await send_conversation_email(capsule.user.email, capsule.conversation)
-                else:
-                    await send_capsule_email(capsule.user.email, capsule)
-                capsule.sent = True
-                session.add(capsule)
-                await session.commit()
-            except Exception:
-                await session.rollback()
-
-    asyncio.run(_send())
+def send_capsules_task(self, capsule_ids: Optional[List[str]] = None):
+    run_async(send_released_capsules(capsule_ids))
 
+@celery_app.task(bind=True)
+def send_capsule_task(self, capsule_id: str):
+    run_async(send_released_capsules([capsule_id]))
+
+
+# Capsules releasing before the next beat tick are dispatched on this tick. When the release
+# scheduler owns dispatch, only capsules already a minute overdue are picked up.
+DISPATCH_HORIZON = timedelta(minutes=-1) if get_settings().release_scheduler else timedelta(minutes=5)
+# Dispatched capsules still unsent after this long are assumed lost and dispatched again
+DISPATCH_TIMEOUT = timedelta(minutes=30)
+
+def reclaim_stale_dispatches(now: datetime):
+    return (
+        update(Capsule)
+        .where(Capsule.sent == False)
+        .where(Capsule.scheduled_at < now - DISPATCH_TIMEOUT)
+        .values(scheduled_at=None)
+    )
+
+def claim_due_capsules(now: datetime):
+    # scheduled_at is the dispatch ledger, claiming and marking in one statement
+    # means each capsule is enqueued exactly once however often the beat runs
+    return (
+        update(Capsule)
+        .where(Capsule.sent == False)
+        .where(Capsule.scheduled_at == None)
+        .where(Capsule.release_date < now + DISPATCH_HORIZON)
+        .values(scheduled_at=now)
+        .returning(Capsule.id, Capsule.release_date)
+    )
 
 @celery_app.task
 def process_pending_capsules():
     async def _task():
-        async with get_db() as session:
-            time_cutoff = current_time() - timedelta(minutes=5)
-
-            stmt = (
-                select(Capsule)
-                .where(Capsule.sent == False)
-                .where(Capsule.release_date > time_cutoff)
-                .order_by(Capsule.release_date.asc())
-            )
-            result = await session.execute(stmt)
-            capsules = result.scalars().all()
-
-            for capsule in capsules:
-                delay = max(0, (capsule.release_date - current_time()).total_seconds())
-                send_capsule_task.apply_async(args=[str(capsule.id)], countdown=delay)
-
-    asyncio.run(_task())
+        async with async_session() as session:
+            now = current_time()
+            await session.execute(reclaim_stale_dispatches(now))
+            result = await session.execute(claim_due_capsules(now))
+            dispatched = sorted(result.all(), key=lambda row: row.release_date)
+            await session.commit()
+
+            # One batch task per release second rather than one task per capsule
+            for release_second, rows in groupby(dispatched, key=lambda row: row.release_date.replace(microsecond=0)):
+                capsule_ids = [str(row.id) for row in rows]
+                delay = max(0, (release_second - current_time()).total_seconds() + 1)
+                size = get_settings().send_batch_size
+                for i in range(0, len(capsule_ids), size):
+                    send_capsules_task.apply_async(args=[capsule_ids[i:i + size]], countdown=delay)
+
+    run_async(_task())
@@ -1,54 +1,205 @@
-from app.database import getenv
-from app.models import Capsule, Conversation
+from app.config import get_settings
+from app.models import Capsule
 from app.utils.encryption import decrypt_content
 
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
 from fastapi.exceptions import HTTPException
-from fastapi.concurrency import run_in_threadpool
 from fastapi import status
 from pydantic import EmailStr
-import html
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, asdict
+from markupsafe import Markup, escape
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import asyncio
+import json
 
-sg = SendGridAPIClient(api_key=getenv('SENDGRID_KEY'))
+SENDER_EMAIL = "no-reply@edisonwang.dev"
+SENDER_NAME = "Time Capsule Journal"
 
-async def send_email(email: EmailStr, subject: str, html_content: str) -> None:
-    message = Mail(
-        from_email=('no-reply@edisonwang.dev', 'Time Capsule Journal'),
-        to_emails=email,
-        subject=subject,
-        html_content=html_content)
+@dataclass
+class EmailMessage:
+    to: str
+    subject: str
+    html: str
+    text: Optional[str] = None
+
+class MailTransport(ABC):
+    def __init__(self, concurrency: Optional[int] = None):
+        self.concurrency = concurrency or get_settings().send_concurrency
+
+    @abstractmethod
+    async def send(self, message: EmailMessage) -> None:
+        ...
+
+    async def send_bulk(self, messages: Sequence[EmailMessage]) -> List[bool]:
+        # Returns whether each message was accepted, in order
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def _send(message: EmailMessage) -> bool:
+            async with semaphore:
+                try:
+                    await self.send(message)
+                    return True
+                except Exception:
+                    return False
+
+        return list(await asyncio.gather(*(_send(message) for message in messages)))
+
+    async def close(self) -> None:
+        pass
+
+class SendGridTransport(MailTransport):
+    # Every message is its own request over the pooled client, bodies are user written
+    # so they are never run through SendGrid's substitution or templating
+    SEND_URL = "https://api.sendgrid.com/v3/mail/send"
+
+    def __init__(self, api_key: str, concurrency: Optional[int] = None):
+        # httpx is only imported by processes that actually send mail
+        import httpx
+        super().__init__(concurrency)
+        # One pooled client per process, connections are reused across sends
+        self.client = httpx.AsyncClient(
+            headers={"Authorization": f"Bearer {api_key}"},
+            limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+            timeout=httpx.Timeout(10.0)
+        )
+
+    @staticmethod
+    def _content(message: EmailMessage) -> List[dict]:
+        content = []
+        if message.text:
+            content.append({"type": "text/plain", "value": message.text})
+        content.append({"type": "text/html", "value": message.html})
+        return content
+
+    async def _post(self, payload: dict) -> None:
+        response = await self.client.post(self.SEND_URL, json=payload)
+        response.raise_for_status()
+
+    async def send(self, message: EmailMessage) -> None:
+        await self._post({
+            "personalizations": [{"to": [{"email": message.to}]}],
+            "from": {"email": SENDER_EMAIL, "name": SENDER_NAME},
+            "subject": message.subject,
+            "content": self._content(message),
+        })
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+class MemoryTransport(MailTransport):
+    def __init__(self, concurrency: Optional[int] = None):
+        super().__init__(concurrency)
+        self.outbox: List[EmailMessage] = []
+
+    async def send(self, message: EmailMessage) -> None:
+        self.outbox.append(message)
+
+class FileTransport(MailTransport):
+    # Appends each message as a JSON line, useful for local development and load tests
+    def __init__(self, path: str, concurrency: Optional[int] = None):
+        super().__init__(concurrency)
+        self.path = path
+
+    async def send(self, message: EmailMessage) -> None:
+        await self.send_bulk([message])
+
+    async def send_bulk(self, messages: Sequence[EmailMessage]) -> List[bool]:
+        with open(self.path, "a") as file:
+            file.writelines(json.dumps(asdict(message)) + "\n" for message in messages)
+        return [True] * len(messages)
+
+_transport: Optional[MailTransport] = None
+
+def get_transport() -> MailTransport:
+    global _transport
+    if _transport is None:
+        settings = get_settings()
+        if settings.mail_transport == "memory":
+            _transport = MemoryTransport()
+        elif settings.mail_transport == "file":
+            _transport = FileTransport(settings.mail_file_path)
+        else:
+            _transport = SendGridTransport(settings.require("sendgrid_key"))
+    return _transport
+
+def set_transport(transport: MailTransport) -> None:
+    global _transport
+    _transport = transport
+
+async def close_transport() -> None:
+    global _transport
+    if _transport is not None:
+        await _transport.close()
+        _transport = None
+
+async def send_message(message: EmailMessage) -> None:
     try:
-        await run_in_threadpool(sg.send, message)
+        await get_transport().send(message)
     except Exception as e:
         raise HTTPException(detail="Something went wrong. Please try again later.", status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
 
+async def send_messages(messages: Sequence[EmailMessage]) -> List[bool]:
+    return await get_transport().send_bulk(messages)
+
+async def send_email(email: EmailStr, subject: str, html_content: str, text_content: Optional[str] = None) -> None:
+    await send_message(EmailMessage(to=email, subject=subject, html=html_content, text=text_content))
+
 async def send_verification_email(email: EmailStr, code: int) -> None:
-    html_content = f"<p>Your verification code is: <strong>{code}</strong></p>"
-    await send_email(email, "Time Capsule Journal 2FA Code", html_content)
+    html_content, text_content = render("verification_email", code=code)
+    await send_email(email, "Time Capsule Journal 2FA Code", html_content, text_content)
+
+def _timestamp(value: datetime) -> str:
+    return value.strftime("%Y-%m-%d %H:%M UTC")
+
+def _nl2br(value: str) -> Markup:
+    return escape(value).replace("\n", Markup("<br>"))
+
+@lru_cache(maxsize=None)
+def get_templates() -> Dict[str, Tuple[Any, Any]]:
+    # Templates are compiled once per process on first render, rendering only runs the compiled code
+    from jinja2 import Environment, PackageLoader, select_autoescape
+    templates = Environment(
+        loader=PackageLoader("app", "templates"),
+        autoescape=select_autoescape(["html"]),
+        trim_blocks=True,
+        lstrip_blocks=True,
+    )
+    templates.filters["timestamp"] = _timestamp
+    templates.filters["nl2br"] = _nl2br
+    return {
+        name: (templates.get_template(f"{name}.html"), templates.get_template(f"{name}.txt"))
+        for name in ("verification_email", "capsule_email", "conversation_email")
+    }
+
+def render(name: str, **context: Any) -> Tuple[str, str]:
+    # generate() streams template chunks, joining once keeps long threads linear
+    html_template, text_template = get_templates()[name]
+    return "".join(html_template.generate(**context)), "".join(text_template.generate(**context))
+
+def _decrypted(capsule: Capsule) -> Dict[str, Any]:
+    return {
+        "id": capsule.id,
+        "creation_date": capsule.creation_date,
+        "content": decrypt_content(capsule.content),
+    }
+
+def render_capsule_email(email: EmailStr, capsule: Capsule) -> EmailMessage:
+    html_content, text_content = render("capsule_email", capsule=_decrypted(capsule))
+    return EmailMessage(to=email, subject="A message from your past self...", html=html_content, text=text_content)
+
+def render_conversation_email(email: EmailStr, capsules: List[Capsule]) -> EmailMessage:
+    # capsules is the thread from load_thread, newest first
+    html_content, text_content = render(
+        "conversation_email",
+        capsule=_decrypted(capsules[0]),
+        thread=[_decrypted(capsule) for capsule in capsules[1:]]
+    )
+    return EmailMessage(to=email, subject="A message from your past self...", html=html_content, text=text_content)
 
 async def send_capsule_email(email: EmailStr, capsule: Capsule) -> None:
-    html_content = f"""
-    <p>One of your capsules has been released, buried since {capsule.creation_date.strftime("%Y-%m-%d %H:%M UTC")}. (ID: {capsule.id})</p><br>
-    <p>{html.escape(decrypt_content(capsule.content)).replace('\n', '<br>')}</p><br>
-    <p>For more information, visit <a href="https://journal.edisonwang.dev">the docs.</a></p>
-    """
-    await send_email(email, "A message from your past self...", html_content)
-
-async def send_conversation_email(email: EmailStr, conversation: Conversation):
-    capsule = conversation.latest_capsule
-    html_content = f"""
-    <p>One of your capsules has been released, buried since {capsule.creation_date.strftime("%Y-%m-%d %H:%M UTC")}. (ID: {capsule.id})</p><br>
-    <p>{html.escape(decrypt_content(capsule.content)).replace('\n', '<br>')}</p><br>
-    <p>This capsule is part of a conversation:</p><br>
-    """
-    capsule = capsule.replying_to
-    while capsule:
-        html_content += f"""
-        <p>Sent at {capsule.creation_date.strftime("%Y-%m-%d %H:%M UTC")}, (ID: {capsule.id})</p><br>
-        <p>{html.escape(decrypt_content(capsule.content)).replace('\n', '<br>')}</p><br>
-        """
-        capsule = capsule.replying_to
-    html_content += """<p>For more information, visit <a href="https://journal.edisonwang.dev">the docs.</a></p>"""
-    await send_email(email, "A message from your past self...", html_content)
-    
+    await send_message(render_capsule_email(email, capsule))
+
+async def send_conversation_email(email: EmailStr, capsules: List[Capsule]):
+    await send_message(render_conversation_email(email, capsules))
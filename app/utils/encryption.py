@@ -1,40 +1,85 @@
-from app.utils.helpers import get_random_string
-from app.database import getenv
+from app.utils.executors import password_executor, crypto_executor
+from app.config import get_settings
+from app.utils.metrics import timed
 
 from passlib.context import CryptContext
 from cryptography.fernet import Fernet
+from functools import lru_cache
+from typing import Callable, List, Optional, Sequence
 import hashlib
+import hmac
 
 password_context = CryptContext(
     schemes=["bcrypt"],
     deprecated="auto",
 )
 
-fernet = Fernet(getenv("FERNET_KEY"))
+# Secrets are read on first use, importing the app does not need them
+@lru_cache(maxsize=None)
+def get_fernet() -> Fernet:
+    return Fernet(get_settings().require("fernet_key"))
 
+@timed("encrypt_content")
 def encrypt_content(content: str) -> str:
-    return fernet.encrypt(content.encode()).decode()
+    return get_fernet().encrypt(content.encode()).decode()
 
+@timed("decrypt_content")
 def decrypt_content(ciphertext: str) -> str:
-    return fernet.decrypt(ciphertext.encode()).decode()
+    return get_fernet().decrypt(ciphertext.encode()).decode()
+
+def _encrypt_chunk(contents: Sequence[str]) -> List[str]:
+    return [encrypt_content(content) for content in contents]
+
+def _decrypt_chunk(ciphertexts: Sequence[str]) -> List[str]:
+    return [decrypt_content(ciphertext) for ciphertext in ciphertexts]
+
+async def _run_chunked(fn: Callable[[Sequence[str]], List[str]], values: Sequence[str]) -> List[str]:
+    # Runs in chunks on the crypto thread pool, results keep the input order
+    size = get_settings().crypto_chunk_size
+    chunks = [values[i:i + size] for i in range(0, len(values), size)]
+    results = await crypto_executor.map(fn, chunks)
+    return [value for chunk in results for value in chunk]
+
+async def encrypt_contents(contents: Sequence[str]) -> List[str]:
+    return await _run_chunked(_encrypt_chunk, contents)
+
+async def decrypt_contents(ciphertexts: Sequence[str]) -> List[str]:
+    return await _run_chunked(_decrypt_chunk, ciphertexts)
 
 MAX_BCRYPT_BYTES = 72
 
-def hash_password(password: str) -> str:
+def _hash_password(password: str) -> str:
     # Truncate to 72 bytes safely
     truncated = password.encode()[:MAX_BCRYPT_BYTES]
     safe_pass = truncated.decode(errors="ignore")  # decode back to string
     return password_context.hash(safe_pass)
 
-def verify_password(password: str, hashed: str) -> bool:
+def _verify_password(password: str, hashed: str) -> bool:
     truncated = password.encode()[:MAX_BCRYPT_BYTES]
     safe_pass = truncated.decode(errors="ignore")
     return password_context.verify(safe_pass, hashed)
 
-def hash_api_key(raw_key: str) -> tuple[str, str]:
-    salt = get_random_string(16)
-    hashed = hashlib.sha256((salt + raw_key).encode()).hexdigest()
-    return hashed, salt
+# bcrypt is deliberately slow, so keep it off the event loop
+@timed("hash_password")
+async def hash_password(password: str) -> str:
+    return await password_executor.run(_hash_password, password)
+
+@timed("verify_password")
+async def verify_password(password: str, hashed: str) -> bool:
+    return await password_executor.run(_verify_password, password, hashed)
+
+# Keys are HMAC-SHA256 under a server-side pepper, so a leaked table alone cannot be brute forced
+@lru_cache(maxsize=None)
+def get_api_key_pepper() -> bytes:
+    return get_settings().require("api_key_pepper").encode()
+
+def hash_api_key(raw_key: str) -> str:
+    return hmac.new(get_api_key_pepper(), raw_key.encode(), hashlib.sha256).hexdigest()
 
-def verify_api_key(raw_key: str, hashed_key: str, salt: str) -> bool:
-    return hashlib.sha256((salt + raw_key).encode()).hexdigest() == hashed_key
\ No newline at end of file
+def verify_api_key(raw_key: str, hashed_key: str, salt: Optional[str] = None) -> bool:
+    # Keys issued before the pepper carry a per-row salt until they are rehashed on first use
+    if salt is not None:
+        expected = hashlib.sha256((salt + raw_key).encode()).hexdigest()
+    else:
+        expected = hash_api_key(raw_key)
+    return hmac.compare_digest(expected, hashed_key)
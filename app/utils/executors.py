@@ -0,0 +1,68 @@
+from app.config import get_settings
+
+from fastapi import HTTPException, status
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, List, Optional, Sequence
+import asyncio
+
+class BoundedExecutor:
+    # Runs blocking work off the event loop. Once max_pending calls are queued or running,
+    # new calls are rejected with a 429 instead of piling up behind each other.
+    def __init__(self, kind: str, workers: int, max_pending: int):
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor: Optional[Executor] = None
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def _admit(self) -> None:
+        if self.pending >= self.max_pending:
+            raise HTTPException(detail="The server is busy, please try again shortly.", status_code=status.HTTP_429_TOO_MANY_REQUESTS)
+        self.pending += 1
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        self._admit()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, partial(fn, *args))
+        finally:
+            self.pending -= 1
+
+    async def map(self, fn: Callable[[Any], Any], items: Sequence[Any]) -> List[Any]:
+        # One admission for the whole batch, so a large request counts once against max_pending
+        # and its items queue on the pool instead of being rejected part way through
+        self._admit()
+        try:
+            loop = asyncio.get_running_loop()
+            return list(await asyncio.gather(*(loop.run_in_executor(self.executor, fn, item) for item in items)))
+        finally:
+            self.pending -= 1
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+settings = get_settings()
+
+password_executor = BoundedExecutor(
+    kind=settings.password_executor,
+    workers=settings.password_workers,
+    max_pending=settings.password_queue_size
+)
+
+crypto_executor = BoundedExecutor(
+    kind="thread",
+    workers=settings.crypto_workers,
+    max_pending=settings.crypto_queue_size
+)
@@ -9,3 +9,9 @@ def get_random_string(length: int) -> str:
 
 def current_time() -> datetime:
     return datetime.now(timezone.utc)
+
+def utc_timestamp(value: datetime) -> float:
+    # Columns are timestamp without time zone holding UTC, naive values must not be read as local time
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
@@ -0,0 +1,59 @@
+from app.config import get_settings
+from app.models import Capsule
+from app.utils.helpers import utc_timestamp
+
+from sqlalchemy import String, bindparam, select, func
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime
+from typing import List, Optional, Sequence, Set, Tuple
+from uuid import UUID
+import heapq
+
+RELEASE_CHANNEL = "capsule_buried"
+
+def release_payload(capsule_id: UUID, release_date: datetime) -> str:
+    return f"{capsule_id}|{utc_timestamp(release_date)}"
+
+async def notify_release(session: AsyncSession, capsule: Capsule) -> None:
+    # Postgres only delivers the notification if and when the surrounding transaction commits
+    if not get_settings().release_scheduler:
+        return
+    await session.execute(select(func.pg_notify(RELEASE_CHANNEL, release_payload(capsule.id, capsule.release_date))))
+
+async def notify_releases(session: AsyncSession, releases: Sequence[Tuple[UUID, datetime]]) -> None:
+    # One statement for the whole batch instead of a round-trip per capsule
+    if not get_settings().release_scheduler or not releases:
+        return
+    payloads = func.unnest(bindparam("payloads", [release_payload(*release) for release in releases], type_=ARRAY(String))).table_valued("payload")
+    await session.execute(select(func.pg_notify(RELEASE_CHANNEL, payloads.c.payload)).select_from(payloads))
+
+def parse_release(payload: str) -> Tuple[str, float]:
+    capsule_id, release_at = payload.split("|")
+    return capsule_id, float(release_at)
+
+class ReleaseQueue:
+    # Min-heap of (release timestamp, capsule id), O(log n) push and pop
+    def __init__(self):
+        self._heap: List[Tuple[float, str]] = []
+        self._queued: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def push(self, release_at: float, capsule_id: str) -> None:
+        if capsule_id in self._queued:
+            return
+        self._queued.add(capsule_id)
+        heapq.heappush(self._heap, (release_at, capsule_id))
+
+    def pop_due(self, now: float) -> List[str]:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, capsule_id = heapq.heappop(self._heap)
+            self._queued.discard(capsule_id)
+            due.append(capsule_id)
+        return due
+
+    def next_release(self) -> Optional[float]:
+        return self._heap[0][0] if self._heap else None
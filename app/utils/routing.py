@@ -0,0 +1,71 @@
+from app.config import get_settings
+from app.database import async_session, async_read_session, get_replica_engine
+from app.utils.authentication import access_api_key, READ_SCOPE
+from app.utils.caching import auth_cache, get_redis
+
+from fastapi import Depends
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import AsyncGenerator, Dict, Optional
+import time
+
+class StickyPrimary:
+    # Keyed by the API key prefix, shared through Redis when the auth cache is shared so every
+    # worker sees the window, with a local copy for the worker that took the write
+    def __init__(self, window: float, client: Optional[Redis] = None):
+        self.window = window
+        self._client = client
+        self._until: Dict[str, float] = {}
+
+    @property
+    def client(self) -> Optional[Redis]:
+        # Falls back to the shared Redis, None when the auth cache runs without it
+        return self._client if self._client is not None else get_redis()
+
+    @staticmethod
+    def _key(prefix: str) -> str:
+        return f"sticky:{prefix}"
+
+    async def mark(self, api_key: str) -> None:
+        prefix = api_key.split("-")[0]
+        now = time.monotonic()
+        self._until[prefix] = now + self.window
+        # Drop expired windows so the dict only holds recent writers
+        if len(self._until) > 10000:
+            self._until = {key: until for key, until in self._until.items() if until > now}
+        if self.client is not None:
+            try:
+                await self.client.set(self._key(prefix), 1, px=max(1, int(self.window * 1000)))
+            except RedisError:
+                pass
+
+    async def active(self, api_key: str) -> bool:
+        prefix = api_key.split("-")[0]
+        if self._until.get(prefix, 0) > time.monotonic():
+            return True
+        if self.client is not None:
+            try:
+                return bool(await self.client.exists(self._key(prefix)))
+            except RedisError:
+                # Without the shared window the primary is the safe choice
+                return True
+        return False
+
+sticky_primary = StickyPrimary(get_settings().sticky_primary_seconds)
+
+def read_only(api_key: str) -> bool:
+    # A read-only key that is already cached locally cannot have written anything, so it skips the sticky check
+    entry = auth_cache.peek(api_key.split("-")[0])
+    return entry is not None and entry.scope == READ_SCOPE
+
+def replica_enabled() -> bool:
+    # Without the shared window a write on one worker is invisible to the others, so every read stays on the primary
+    return get_replica_engine() is not None and sticky_primary.client is not None
+
+async def get_read_db(api_key: str = Depends(access_api_key)) -> AsyncGenerator[AsyncSession, None]:
+    factory = async_read_session
+    if not replica_enabled() or (not read_only(api_key) and await sticky_primary.active(api_key)):
+        factory = async_session
+    async with factory() as session:
+        yield session
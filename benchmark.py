@@ -0,0 +1,329 @@
+# Micro-benchmarks for the per-request crypto, helper and validation hot paths.
+#
+#   python benchmark.py                 compare against benchmark_baseline.json, exits 1 on a regression
+#   python benchmark.py --save          record a new baseline
+#   python benchmark.py --threshold 0.5 allow calls to get up to 50% slower
+#   python benchmark.py --only import    just the cold start budget
+#
+# Needs the same .env as the app. Baselines are machine specific, record one on the machine you compare on.
+# import_app_main is the cumulative `python -X importtime` cost of app.main, measured with the database,
+# Redis, mail and encryption settings removed from the environment so it also fails if importing starts
+# needing them again.
+
+from argparse import ArgumentParser
+from datetime import timedelta
+from typing import Awaitable, Callable, Dict, List
+import asyncio
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+import timeit
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(ROOT, "benchmark_baseline.json")
+# Settings that must only be read on first use, never at import
+LAZY_SETTINGS = ("DB_", "REDIS_", "FERNET_KEY", "API_KEY_PEPPER", "SENDGRID_", "MAIL_")
+
+def benchmarks() -> Dict[str, Callable[[], object]]:
+    from app.utils.encryption import encrypt_content, decrypt_content, hash_api_key, verify_api_key
+    from app.utils.helpers import get_random_string
+    from app.users.schemas import UserCreateSchema, UserUpdateSchema, UserPasswordResetSchema, APIKeyCreateSchema
+    from app.capsules.schemas import CapsuleCreateSchema
+
+    # Capsules are capped at 250 characters, so that is the realistic worst case
+    content = "x" * 250
+    ciphertext = encrypt_content(content)
+    raw_key = get_random_string(48)
+    hashed_key = hash_api_key(raw_key)
+
+    return {
+        "encrypt_content": lambda: encrypt_content(content),
+        "decrypt_content": lambda: decrypt_content(ciphertext),
+        "hash_api_key": lambda: hash_api_key(raw_key),
+        "verify_api_key": lambda: verify_api_key(raw_key, hashed_key),
+        "get_random_string_48": lambda: get_random_string(48),
+        "UserCreateSchema": lambda: UserCreateSchema.model_validate({"username": " someone ", "email": " Someone@Example.com ", "password": "Passw0rdExample", "confirm_password": "Passw0rdExample"}),
+        "UserUpdateSchema": lambda: UserUpdateSchema.model_validate({"username": "someone", "email": "someone@example.com"}),
+        "UserPasswordResetSchema": lambda: UserPasswordResetSchema.model_validate({"old_password": "Passw0rdExample", "new_password": "Passw0rdExample2", "confirm_new_password": "Passw0rdExample2"}),
+        "APIKeyCreateSchema": lambda: APIKeyCreateSchema.model_validate({"username": "someone", "password": "Passw0rdExample"}),
+        "CapsuleCreateSchema": lambda: CapsuleCreateSchema.model_validate({"content": content, "time_held": timedelta(days=30), "replying_to_id": "6f1c1a8e-3f4e-4b8a-9a57-2f8c0c5e7d11"}),
+        **render_benchmarks(),
+        **thread_benchmarks(),
+    }
+
+def sqlite_session(loop: asyncio.AbstractEventLoop):
+    # In-memory SQLite with the app's tables, stands in for Postgres when timing query shapes and counts
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from sqlalchemy.pool import StaticPool
+    from sqlmodel import SQLModel
+    import app.models
+
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", poolclass=StaticPool)
+
+    async def create():
+        async with engine.begin() as connection:
+            await connection.run_sync(SQLModel.metadata.create_all)
+
+    loop.run_until_complete(create())
+    return AsyncSession(engine, expire_on_commit=False)
+
+async def seed_thread(session, length: int):
+    # A user with one released conversation of length capsules, oldest first
+    from app.models import Capsule, Conversation, User
+    from app.utils.encryption import encrypt_content
+    from app.utils.helpers import current_time
+    from uuid import uuid4
+
+    now = current_time()
+    user = User(username=f"bench{uuid4().hex[:8]}", email=f"{uuid4().hex[:8]}@example.com", hashed_password="x", email_verified=True)
+    session.add(user)
+    conversation = Conversation(user_id=user.id)
+    thread = []
+    for i in range(length):
+        created = now - timedelta(days=length - i + 1)
+        thread.append(Capsule(id=uuid4(), user_id=user.id, conversation_id=conversation.id, content=encrypt_content(f"reply {i} " + "x" * 240), creation_date=created, time_held=timedelta(hours=1), release_date=created + timedelta(hours=1), replying_to_id=thread[-1].id if thread else None, sent=True))
+    conversation.latest_capsule_id = thread[-1].id
+    await session.flush()
+    session.add_all(thread)
+    await session.flush()
+    session.add(conversation)
+    await session.commit()
+    return user, conversation, thread
+
+def render_benchmarks() -> Dict[str, Callable[[], object]]:
+    # A 500 message conversation email, the template alone and with decrypting every capsule
+    from app.models import Capsule
+    from app.utils.emailing import render, render_conversation_email
+    from app.utils.encryption import encrypt_content
+    from app.utils.helpers import current_time
+    from uuid import uuid4
+
+    now = current_time()
+    capsules = [Capsule(id=uuid4(), user_id=uuid4(), content=encrypt_content(f"message {i}\n" + "x <b>&</b> " * 22), creation_date=now - timedelta(days=i), time_held=timedelta(days=1), release_date=now) for i in range(500)]
+    plain = [{"id": capsule.id, "creation_date": capsule.creation_date, "content": f"message {i}\n" + "x <b>&</b> " * 22} for i, capsule in enumerate(capsules)]
+    return {
+        "render_conversation_500": lambda: render("conversation_email", capsule=plain[0], thread=plain[1:]),
+        "render_conversation_email_500": lambda: render_conversation_email("someone@example.com", capsules),
+    }
+
+def thread_benchmarks() -> Dict[str, Callable[[], object]]:
+    # Loading a whole conversation is one recursive query however long the thread is
+    from app.capsules.crud import load_thread
+
+    loop = asyncio.new_event_loop()
+    session = sqlite_session(loop)
+    cases = {}
+    for length in (1, 50, 500):
+        _, conversation, _ = loop.run_until_complete(seed_thread(session, length))
+        cases[f"load_thread_{length}"] = lambda latest=conversation.latest_capsule_id: loop.run_until_complete(load_thread(session, latest))
+    return cases
+
+def import_time(module: str = "app.main") -> float:
+    # Fresh interpreter per run so nothing is already imported, microseconds including dependencies
+    env = {key: value for key, value in os.environ.items() if not key.startswith(LAZY_SETTINGS)}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        sys.exit(f"import {module} failed without the lazily read settings:\n{result.stderr.strip().splitlines()[-1]}")
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|\s*(\S+)$", line)
+        if match and match.group(2) == module:
+            return float(match.group(1))
+    sys.exit(f"no importtime entry for {module}")
+
+async def loop_lag(work: Awaitable[object], tick: float = 0.001) -> List[float]:
+    # How late a 1ms ticker wakes up while work runs, in microseconds per tick
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(tick)
+            lags.append((time.perf_counter() - start - tick) * 1e6)
+
+    task = asyncio.create_task(ticker())
+    try:
+        await work
+    finally:
+        done.set()
+        await task
+    return lags
+
+def login_loop_lag(logins: int = 4) -> float:
+    # p99 event loop lag while concurrent logins run bcrypt, stays near the timer resolution
+    # only as long as password hashing is kept off the event loop
+    from app.utils.encryption import _hash_password, verify_password
+
+    async def run():
+        hashed = _hash_password("Passw0rdExample")
+        # Start the pool outside the measurement, worker processes are spawned on first use
+        await verify_password("Passw0rdExample", hashed)
+        lags = await loop_lag(asyncio.gather(*(verify_password("Passw0rdExample", hashed) for _ in range(logins))))
+        return percentile(lags, 0.99)
+
+    return asyncio.run(run())
+
+def release_send(emails: int = 100, latency: float = 0.005) -> Callable[[], float]:
+    # Microseconds per release email through send_released_capsules, against SQLite and a stub sender
+    # that takes latency seconds per message, so the number reflects batching and send concurrency
+    from app.database import _engines
+    from app.models import Capsule, User
+    from app.utils.celery import send_released_capsules
+    from app.utils.emailing import MailTransport, set_transport
+    from app.utils.encryption import encrypt_content
+    from app.utils.helpers import current_time
+    from sqlalchemy import update
+
+    class StubTransport(MailTransport):
+        async def send(self, message) -> None:
+            await asyncio.sleep(latency)
+
+    loop = asyncio.new_event_loop()
+    session = sqlite_session(loop)
+
+    async def seed():
+        now = current_time()
+        user = User(username="release", email="release@example.com", hashed_password="x", email_verified=True)
+        session.add(user)
+        await session.flush()
+        session.add_all(Capsule(user_id=user.id, content=encrypt_content("x" * 250), creation_date=now - timedelta(days=2), time_held=timedelta(days=1), release_date=now - timedelta(days=1)) for _ in range(emails))
+        await session.commit()
+
+    loop.run_until_complete(seed())
+
+    async def run():
+        await session.execute(update(Capsule).values(sent=False))
+        await session.commit()
+        _engines["primary"] = session.bind
+        set_transport(StubTransport())
+        start = time.perf_counter()
+        sent = await send_released_capsules()
+        elapsed = time.perf_counter() - start
+        assert sent == emails, sent
+        return elapsed / sent * 1e6
+
+    return lambda: loop.run_until_complete(run())
+
+def middleware_overhead(requests: int = 2000) -> float:
+    # Microseconds MetricsMiddleware adds to a request, against the same trivial ASGI app without it
+    from app.utils.metrics import MetricsMiddleware
+
+    async def endpoint(scope, receive, send):
+        # Routing sets the matched route on the scope, the middleware labels the request by its template
+        scope["route"] = route
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        pass
+
+    class route:
+        path = "/capsules/{capsule_id}"
+
+    async def run(app) -> float:
+        start = time.perf_counter()
+        for _ in range(requests):
+            await app({"type": "http", "method": "GET", "path": "/capsules/1"}, receive, send)
+        return time.perf_counter() - start
+
+    async def compare():
+        wrapped = MetricsMiddleware(endpoint)
+        await run(wrapped)
+        return (await run(wrapped) - await run(endpoint)) / requests * 1e6
+
+    return asyncio.run(compare())
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def probes() -> Dict[str, Callable[[], float]]:
+    # Scenarios that time themselves and return microseconds, the best of --repeat runs is kept
+    return {
+        "import_app_main": import_time,
+        "login_loop_lag_p99": login_loop_lag,
+        "release_send_per_email": release_send(),
+        "metrics_middleware_overhead": middleware_overhead,
+    }
+
+# Absolute limits in microseconds, checked on every run regardless of the baseline
+BUDGETS = {
+    "metrics_middleware_overhead": 50,
+}
+
+def measure(fn: Callable[[], object], repeat: int, min_time: float) -> float:
+    # Best of several runs in microseconds per call, the minimum is the least noisy estimate
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    number = max(number, int(number * min_time / 0.2))
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e6
+
+def main() -> None:
+    parser = ArgumentParser(description="Benchmark per-request hot paths against a stored baseline.")
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown as a fraction of the baseline")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per timing run")
+    parser.add_argument("--only", help="substring filter on benchmark names")
+    args = parser.parse_args()
+
+    results = {}
+    for name, fn in benchmarks().items():
+        if args.only and args.only not in name:
+            continue
+        results[name] = round(measure(fn, args.repeat, args.min_time), 3)
+    for name, probe in probes().items():
+        if args.only and args.only not in name:
+            continue
+        results[name] = round(min(probe() for _ in range(args.repeat)), 3)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results_us"]
+
+    if args.save:
+        # With --only the other entries of the existing baseline are kept
+        with open(args.baseline, "w") as file:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(), "results_us": {**baseline, **results}}, file, indent=2)
+            file.write("\n")
+        for name, value in results.items():
+            print(f"{name:<32} {value:>10.3f} us")
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    regressions = []
+    for name, value in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            print(f"{name:<32} {value:>10.3f} us   (no baseline)")
+            continue
+        change = value / previous - 1
+        flag = ""
+        if change > args.threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:<32} {value:>10.3f} us   baseline {previous:>10.3f} us   {change:+7.1%}{flag}")
+
+    for name, budget in BUDGETS.items():
+        if name in results and results[name] > budget:
+            print(f"{name} takes {results[name]:.3f} us, over its {budget} us budget")
+            regressions.append(name)
+
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) over budget or slower than the baseline by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
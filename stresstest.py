@@ -1,30 +1,236 @@
+# Local load harness, point it at a development database and app instance, never production.
+#
+#   python stresstest.py seed --users 50 --thread-length 50
+#   uvicorn app.main:app --workers 4
+#   python stresstest.py run --scenario reads --mode closed --concurrency 64 --duration 30 --output reads.json
+#   python stresstest.py run --scenario posting --mode open --rate 200 --duration 30
+#
+# Closed loop keeps --concurrency requests in flight and measures sustained throughput.
+# Open loop issues --rate requests per second on a fixed schedule whether or not earlier requests
+# have finished, latency is measured from the scheduled start so a slow server cannot hide its queueing.
+
+from argparse import ArgumentParser
+from collections import Counter, defaultdict
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
 import asyncio
 import httpx
+import itertools
+import json
+import random
+import sys
 import time
 
-URL = "https://journal.edisonwang.dev/" + input("Endpoint: ")
-CONCURRENCY = int(input("Concurrency: "))
-TOTAL_REQUESTS = int(input("Total Requests: "))
-
-async def fetch(client):
-    resp = await client.get(URL)
-    return resp.status_code
-
-async def main():
-    async with httpx.AsyncClient() as client:
-        tasks = []
-        start = time.time()
-        for _ in range(TOTAL_REQUESTS):
-            tasks.append(fetch(client))
-            if len(tasks) >= CONCURRENCY:
-                results = await asyncio.gather(*tasks)
-                tasks = []
-        if tasks:
-            results = await asyncio.gather(*tasks)
-        elapsed = time.time() - start
-        rps = TOTAL_REQUESTS / elapsed
-        print(f"Total time: {elapsed:.2f}s")
-        print(f"Requests per second: {rps:.2f} req/sec")
-        print(f"Requests per minute: {rps * 60:.2f} req/min")
-
-asyncio.run(main())
\ No newline at end of file
+SEED_PREFIX = "load_"
+SEED_PASSWORD = "Loadtest1pass"
+LOCAL_HOSTS = ("127.0.0.1", "localhost", "0.0.0.0", "::1")
+
+async def seed(users: int, capsules: int, thread_length: int, path: str, rng: random.Random) -> None:
+    # Writes straight to the database in .env, users are verified so they can post without email
+    from app.database import async_session
+    from app.models import APIKey, Capsule, Conversation, User
+    from app.utils.encryption import _hash_password, encrypt_content, hash_api_key
+    from app.utils.helpers import current_time, get_random_string
+    from sqlalchemy import delete
+
+    hashed_password = _hash_password(SEED_PASSWORD)
+    now = current_time()
+    seeded = []
+    async with async_session() as session:
+        await session.execute(delete(User).where(User.username.like(f"{SEED_PREFIX}%")))
+        for n in range(users):
+            user = User(username=f"{SEED_PREFIX}{n}", email=f"{SEED_PREFIX}{n}@example.com", hashed_password=hashed_password, email_verified=True)
+            session.add(user)
+            await session.flush()
+            prefix, raw_key = get_random_string(12), get_random_string(48)
+            session.add(APIKey(user_id=user.id, prefix=prefix, hashed_key=hash_api_key(raw_key)))
+
+            for _ in range(capsules):
+                held = timedelta(days=rng.randint(1, 365))
+                session.add(Capsule(user_id=user.id, content=encrypt_content(f"capsule {rng.random()}"), creation_date=now - held - timedelta(days=1), time_held=held, release_date=now - timedelta(days=1), sent=True))
+
+            # One long released thread per user, oldest first
+            thread = []
+            for i in range(thread_length):
+                created = now - timedelta(days=thread_length - i + 1)
+                capsule = Capsule(user_id=user.id, content=encrypt_content(f"reply {i} {rng.random()}"), creation_date=created, time_held=timedelta(hours=1), release_date=created + timedelta(hours=1), replying_to_id=thread[-1].id if thread else None, sent=True)
+                session.add(capsule)
+                await session.flush()
+                thread.append(capsule)
+            conversation_id = None
+            if thread:
+                conversation = Conversation(user_id=user.id, latest_capsule_id=thread[-1].id)
+                session.add(conversation)
+                await session.flush()
+                for capsule in thread:
+                    capsule.conversation_id = conversation.id
+                conversation_id = str(conversation.id)
+
+            seeded.append({"username": user.username, "password": SEED_PASSWORD, "key": prefix + "-" + raw_key, "conversation_id": conversation_id})
+        await session.commit()
+    with open(path, "w") as file:
+        json.dump(seeded, file, indent=2)
+    print(f"Seeded {users} users into the database, credentials written to {path}")
+
+class Scenario:
+    def __init__(self, name: str, users: List[Dict[str, Any]], rng: random.Random):
+        self.name = name
+        self.users = users
+        self.rng = rng
+        self._next_user = itertools.cycle(range(len(users)))
+
+    def user(self) -> Dict[str, Any]:
+        return self.users[next(self._next_user)]
+
+    async def __call__(self, client: httpx.AsyncClient) -> Tuple[httpx.Response, str]:
+        user = self.user()
+        headers = {"api-key": user["key"]}
+        if self.name == "reads":
+            # Every request authenticates, so this mostly exercises the auth path and the read queries
+            path = self.rng.choice(("/users/me", "/capsules", "/capsules/conversations"))
+            return await client.get(path, headers=headers), path
+        if self.name == "posting":
+            body = {"content": f"load test {self.rng.random()}", "time_held": 3600 * self.rng.randint(1, 24 * 365)}
+            return await client.post("/capsules/post", json=body, headers=headers), "/capsules/post"
+        if self.name == "conversations":
+            return await client.get(f"/capsules/conversations/{user['conversation_id']}", headers=headers), "/capsules/conversations/{id}"
+        if self.name == "regen":
+            response = await client.post("/users/api-key/regen", json={"username": user["username"], "password": user["password"]})
+            if response.status_code == 200:
+                user["key"] = response.json()["key"]
+            return response, "/users/api-key/regen"
+        raise ValueError(f"Unknown scenario {self.name}")
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+        self.completed = 0
+
+    def record(self, endpoint: str, latency: float, response: Optional[httpx.Response], error: Optional[BaseException]) -> None:
+        self.completed += 1
+        if error is not None:
+            self.errors[type(error).__name__] += 1
+            return
+        self.latencies[endpoint].append(latency)
+        if response.status_code >= 400:
+            self.errors[f"{endpoint} {response.status_code}"] += 1
+
+async def timed_request(scenario: Scenario, client: httpx.AsyncClient, recorder: Recorder, started: float) -> None:
+    try:
+        response, endpoint = await scenario(client)
+        recorder.record(endpoint, time.perf_counter() - started, response, None)
+    except Exception as e:
+        recorder.record(scenario.name, time.perf_counter() - started, None, e)
+
+async def closed_loop(scenario: Scenario, client: httpx.AsyncClient, recorder: Recorder, concurrency: int, duration: float) -> None:
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            await timed_request(scenario, client, recorder, time.perf_counter())
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+async def open_loop(scenario: Scenario, client: httpx.AsyncClient, recorder: Recorder, rate: float, duration: float) -> None:
+    start = time.perf_counter()
+    tasks = set()
+    for n in itertools.count():
+        scheduled = start + n / rate
+        if scheduled - start >= duration:
+            break
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        task = asyncio.create_task(timed_request(scenario, client, recorder, scheduled))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    await asyncio.gather(*tasks)
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+def summary(values: List[float]) -> Dict[str, Any]:
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 0.50), 3),
+        "p95_ms": round(percentile(values, 0.95), 3),
+        "p99_ms": round(percentile(values, 0.99), 3),
+        "max_ms": round(max(values) * 1000, 3),
+    }
+
+def report(args, recorder: Recorder, elapsed: float) -> Dict[str, Any]:
+    all_latencies = [latency for latencies in recorder.latencies.values() for latency in latencies]
+    return {
+        "scenario": args.scenario,
+        "mode": args.mode,
+        "concurrency": args.concurrency if args.mode == "closed" else None,
+        "target_rate": args.rate if args.mode == "open" else None,
+        "duration_s": round(elapsed, 3),
+        "requests": recorder.completed,
+        "throughput_rps": round(recorder.completed / elapsed, 2) if elapsed else 0.0,
+        "errors": sum(recorder.errors.values()),
+        "error_breakdown": dict(recorder.errors),
+        "latency": summary(all_latencies),
+        "endpoints": {endpoint: summary(latencies) for endpoint, latencies in recorder.latencies.items()},
+    }
+
+async def run(args) -> None:
+    if urlparse(args.url).hostname not in LOCAL_HOSTS and not args.allow_remote:
+        sys.exit(f"{args.url} is not a local address, pass --allow-remote if that is intended")
+    with open(args.credentials) as file:
+        users = json.load(file)
+    rng = random.Random(args.seed)
+    scenario = Scenario(args.scenario, users, rng)
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+        start = time.perf_counter()
+        if args.mode == "closed":
+            await closed_loop(scenario, client, recorder, args.concurrency, args.duration)
+        else:
+            await open_loop(scenario, client, recorder, args.rate, args.duration)
+        elapsed = time.perf_counter() - start
+    result = json.dumps(report(args, recorder, elapsed), indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(result + "\n")
+    print(result)
+
+def main() -> None:
+    parser = ArgumentParser(description="Load test a local Time Capsule Journal instance.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = commands.add_parser("seed", help="create verified users, keys, capsules and long conversations")
+    seed_parser.add_argument("--users", type=int, default=50)
+    seed_parser.add_argument("--capsules", type=int, default=100, help="released capsules per user")
+    seed_parser.add_argument("--thread-length", type=int, default=50, help="capsules in each user's conversation")
+    seed_parser.add_argument("--credentials", default="loadtest_users.json")
+    seed_parser.add_argument("--seed", type=int, default=0)
+
+    run_parser = commands.add_parser("run", help="run a scenario and report latency as JSON")
+    run_parser.add_argument("--scenario", choices=("reads", "posting", "conversations", "regen"), default="reads")
+    run_parser.add_argument("--mode", choices=("closed", "open"), default="closed")
+    run_parser.add_argument("--concurrency", type=int, default=32, help="in-flight requests in closed loop mode")
+    run_parser.add_argument("--rate", type=float, default=100.0, help="requests per second in open loop mode")
+    run_parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    run_parser.add_argument("--url", default="http://127.0.0.1:8000")
+    run_parser.add_argument("--connections", type=int, default=100)
+    run_parser.add_argument("--timeout", type=float, default=30.0)
+    run_parser.add_argument("--credentials", default="loadtest_users.json")
+    run_parser.add_argument("--output", help="also write the JSON report here")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--allow-remote", action="store_true")
+
+    args = parser.parse_args()
+    if args.command == "seed":
+        asyncio.run(seed(args.users, args.capsules, args.thread_length, args.credentials, random.Random(args.seed)))
+    else:
+        asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+from cryptography.fernet import Fernet
+from contextlib import contextmanager
+from typing import Iterator, List
+import os
+
+# Settings are read once per process, so test secrets have to be in place before the app is imported
+os.environ.setdefault("FERNET_KEY", Fernet.generate_key().decode())
+os.environ.setdefault("API_KEY_PEPPER", "test-pepper")
+os.environ["AUTH_CACHE_REDIS"] = "0"
+
+from app.models import APIKey, User
+from app.utils.encryption import hash_api_key
+from app.utils.helpers import get_random_string
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel
+import asyncio
+import pytest
+
+@pytest.fixture
+def loop() -> Iterator[asyncio.AbstractEventLoop]:
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+@pytest.fixture
+def engine(loop) -> Iterator[AsyncEngine]:
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", poolclass=StaticPool)
+
+    async def create():
+        async with engine.begin() as connection:
+            await connection.run_sync(SQLModel.metadata.create_all)
+
+    loop.run_until_complete(create())
+    yield engine
+    loop.run_until_complete(engine.dispose())
+
+@pytest.fixture
+def session(loop, engine) -> Iterator[AsyncSession]:
+    session = AsyncSession(engine, expire_on_commit=False)
+    yield session
+    loop.run_until_complete(session.close())
+
+@contextmanager
+def count_queries(engine: AsyncEngine) -> Iterator[List[str]]:
+    # Collects every statement sent to the database while the block runs
+    statements: List[str] = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", record)
+
+async def create_user(session: AsyncSession, scope: str = "write") -> tuple[User, str]:
+    # A verified user with one API key, returns the raw key
+    user = User(username=f"user{get_random_string(8)}", email=f"{get_random_string(8)}@example.com", hashed_password="x", email_verified=True)
+    session.add(user)
+    await session.flush()
+    prefix, raw_key = get_random_string(12), get_random_string(48)
+    session.add(APIKey(user_id=user.id, prefix=prefix, hashed_key=hash_api_key(raw_key), scope=scope))
+    await session.commit()
+    return user, prefix + "-" + raw_key
@@ -0,0 +1,100 @@
+from app.models import APIKey, User
+from app.utils.caching import AuthCache, SharedAuthCache
+
+from fakeredis.aioredis import FakeRedis
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from typing import Tuple
+import asyncio
+
+def make_key() -> Tuple[APIKey, User]:
+    user = User(username="someone", email="someone@example.com", hashed_password="$2b$12$secret", email_verified=True)
+    return APIKey(user_id=user.id, prefix="abcdefghijkl", hashed_key="hashed", scope="read"), user
+
+def workers(count: int = 2):
+    # Separate local tiers over one Redis, like uvicorn workers sharing the Celery Redis
+    redis = FakeRedis()
+    return [AuthCache(maxsize=100, ttl=60, shared=SharedAuthCache(redis, 60)) for _ in range(count)]
+
+def test_invalidation_reaches_every_worker():
+    async def run():
+        first, second = workers()
+        key_obj, user = make_key()
+        await first.set(key_obj, user, await first.generation())
+        assert await second.get(key_obj.prefix) is not None
+        assert first.peek(key_obj.prefix) is not None and second.peek(key_obj.prefix) is not None
+
+        await first.invalidate(user.id, key_obj.prefix)
+        assert await second.get(key_obj.prefix) is None
+        assert await first.get(key_obj.prefix) is None
+    asyncio.run(run())
+
+def test_invalidation_during_load_is_not_overwritten():
+    async def run():
+        first, second = workers()
+        key_obj, user = make_key()
+        generation = await first.generation()
+        # Another worker revokes the key between the SELECT and set()
+        await second.invalidate(user.id)
+        await first.set(key_obj, user, generation)
+        assert await first.get(key_obj.prefix) is None
+        assert await second.get(key_obj.prefix) is None
+    asyncio.run(run())
+
+def test_set_without_generation_is_skipped():
+    async def run():
+        (cache,) = workers(1)
+        key_obj, user = make_key()
+        await cache.set(key_obj, user)
+        assert await cache.get(key_obj.prefix) is None
+    asyncio.run(run())
+
+def test_snapshot_excludes_password_hash():
+    async def run():
+        (cache,) = workers(1)
+        key_obj, user = make_key()
+        await cache.set(key_obj, user, await cache.generation())
+        raw = await cache.shared.client.get(SharedAuthCache._entry_key(key_obj.prefix))
+        assert b"hashed_password" not in raw and b"secret" not in raw
+
+        entry = await cache.get(key_obj.prefix)
+        engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+        async with AsyncSession(engine) as session:
+            attached = await entry.attach(session)
+            assert attached.user.username == "someone"
+        await engine.dispose()
+    asyncio.run(run())
+
+def test_attached_user_has_no_password_hash_loaded():
+    async def run():
+        (cache,) = workers(1)
+        key_obj, user = make_key()
+        await cache.set(key_obj, user, await cache.generation())
+        entry = await cache.get(key_obj.prefix)
+        engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+        async with AsyncSession(engine) as session:
+            attached = await entry.attach(session)
+            assert "hashed_password" not in attached.user.__dict__
+        await engine.dispose()
+    asyncio.run(run())
+
+def test_expired_key_is_rejected_and_not_cached(monkeypatch, loop, session):
+    from app.utils import authentication
+    from app.utils.helpers import current_time
+    from fastapi import HTTPException
+    from sqlmodel import select
+    from tests.conftest import create_user
+    from datetime import timedelta
+    import pytest
+
+    (cache,) = workers(1)
+    monkeypatch.setattr(authentication, "auth_cache", cache)
+    user, api_key = loop.run_until_complete(create_user(session))
+    key_obj = loop.run_until_complete(session.execute(select(APIKey).where(APIKey.user_id == user.id))).scalars().one()
+    # Read back naive from the column, it must still count as an hour ago whatever the local timezone is
+    key_obj.expires_at = current_time() - timedelta(hours=1)
+    loop.run_until_complete(session.commit())
+    session.expunge_all()
+    with pytest.raises(HTTPException) as error:
+        loop.run_until_complete(authentication.authenticate_api_key(session, api_key))
+    assert error.value.status_code == 401
+    assert cache.peek(key_obj.prefix) is None
@@ -0,0 +1,20 @@
+from app.capsules.crud import create_capsules
+from app.models import Capsule
+from app.utils.encryption import decrypt_content
+
+from tests.conftest import create_user
+from datetime import timedelta
+from uuid import uuid4
+
+def test_bulk_create_pairs_items_with_their_rows(loop, session):
+    user, api_key = loop.run_until_complete(create_user(session))
+    items = [{"content": f"capsule {i}", "time_held": timedelta(days=i + 1)} for i in range(40)]
+    items[3] = {"content": "x" * 251, "time_held": timedelta(days=1)}
+    items[7] = {"content": "reply", "time_held": timedelta(days=1), "replying_to_id": str(uuid4())}
+    result = loop.run_until_complete(create_capsules(session, api_key, items))
+    assert [error["index"] for error in result["errors"]] == [3, 7]
+    assert len(result["created"]) == 38
+    for created in result["created"]:
+        capsule = loop.run_until_complete(session.get(Capsule, created["id"]))
+        assert decrypt_content(capsule.content) == items[created["index"]]["content"]
+        assert capsule.time_held == items[created["index"]]["time_held"]
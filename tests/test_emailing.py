@@ -0,0 +1,37 @@
+from app.utils.emailing import EmailMessage, MailTransport, SendGridTransport
+
+import asyncio
+import httpx
+import json
+import pytest
+
+def test_mail_transport_is_abstract():
+    with pytest.raises(TypeError):
+        MailTransport()
+
+def test_sendgrid_sends_each_message_verbatim():
+    async def run():
+        requests = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            requests.append(json.loads(request.content))
+            return httpx.Response(500 if "fail" in requests[-1]["personalizations"][0]["to"][0]["email"] else 202)
+
+        transport = SendGridTransport("key", concurrency=4)
+        await transport.client.aclose()
+        transport.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        # Capsule text is user written, SendGrid substitution tokens in it must arrive untouched
+        messages = [
+            EmailMessage(to="a@example.com", subject="s", html="<p>-html- -text-</p>", text="-text-"),
+            EmailMessage(to="fail@example.com", subject="s", html="<p>b</p>"),
+            EmailMessage(to="c@example.com", subject="s", html="x" * 20000),
+        ]
+        assert await transport.send_bulk(messages) == [True, False, True]
+        await transport.close()
+
+        assert len(requests) == 3
+        for payload in requests:
+            assert "substitutions" not in payload["personalizations"][0]
+        first = next(payload for payload in requests if payload["personalizations"][0]["to"][0]["email"] == "a@example.com")
+        assert first["content"] == [{"type": "text/plain", "value": "-text-"}, {"type": "text/html", "value": "<p>-html- -text-</p>"}]
+    asyncio.run(run())
@@ -0,0 +1,39 @@
+from app.utils.executors import BoundedExecutor
+
+from fastapi import HTTPException
+import asyncio
+import pytest
+
+def test_map_counts_one_request_against_the_limit():
+    async def run():
+        executor = BoundedExecutor(kind="thread", workers=2, max_pending=1)
+        try:
+            # Far more chunks than max_pending, all queued on the pool rather than rejected
+            assert await executor.map(abs, range(-50, 0)) == list(range(50, 0, -1))
+            assert executor.pending == 0
+        finally:
+            executor.shutdown()
+    asyncio.run(run())
+
+def test_requests_over_the_limit_are_rejected():
+    async def run():
+        executor = BoundedExecutor(kind="thread", workers=1, max_pending=1)
+        started = asyncio.Event()
+        release = asyncio.Event()
+        loop = asyncio.get_running_loop()
+
+        def block(_):
+            loop.call_soon_threadsafe(started.set)
+            asyncio.run_coroutine_threadsafe(release.wait(), loop).result()
+
+        try:
+            first = asyncio.create_task(executor.map(block, [None]))
+            await started.wait()
+            with pytest.raises(HTTPException) as error:
+                await executor.map(abs, [1])
+            assert error.value.status_code == 429
+            release.set()
+            await first
+        finally:
+            executor.shutdown()
+    asyncio.run(run())
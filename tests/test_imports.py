@@ -0,0 +1,12 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_app_imports_with_incomplete_redis_settings():
+    # Redis settings are only required once a request uses Redis, a half filled .env must not break the import
+    env = {key: value for key, value in os.environ.items() if not key.startswith("REDIS_")}
+    env.update(REDIS_HOST="localhost", AUTH_CACHE_REDIS="1")
+    result = subprocess.run([sys.executable, "-c", "import app.main"], cwd=ROOT, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,35 @@
+from app.capsules.crud import list_conversations
+from app.models import Capsule, Conversation
+from app.utils.encryption import encrypt_content
+from app.utils.helpers import current_time
+
+from tests.conftest import count_queries, create_user
+from datetime import timedelta
+from uuid import uuid4
+
+async def create_conversations(session, user, count: int) -> None:
+    now = current_time()
+    for i in range(count):
+        root = Capsule(id=uuid4(), user_id=user.id, content=encrypt_content(f"root {i}"), creation_date=now - timedelta(days=3), time_held=timedelta(days=1), release_date=now - timedelta(days=2), sent=True)
+        reply = Capsule(id=uuid4(), user_id=user.id, content=encrypt_content(f"reply {i}"), creation_date=now - timedelta(days=2), time_held=timedelta(days=1), release_date=now - timedelta(days=1), replying_to_id=root.id, sent=True)
+        conversation = Conversation(user_id=user.id, latest_capsule_id=reply.id)
+        root.conversation_id = reply.conversation_id = conversation.id
+        session.add_all([root, reply])
+        await session.flush()
+        session.add(conversation)
+    await session.commit()
+
+def test_list_conversations_query_count_is_constant(loop, engine, session):
+    counts = {}
+    for size in (1, 25):
+        user, api_key = loop.run_until_complete(create_user(session))
+        loop.run_until_complete(create_conversations(session, user, size))
+        session.expunge_all()
+        with count_queries(engine) as statements:
+            result = loop.run_until_complete(list_conversations(session, api_key))
+            # Serializing the response touches latest_capsule on every row
+            assert all(conversation.reply_allowed is not None for conversation in result["conversations"])
+        assert len(result["conversations"]) == size
+        counts[size] = len(statements)
+    # One query to authenticate the key, one for the conversations and their latest capsules
+    assert counts == {1: 2, 25: 2}
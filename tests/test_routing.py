@@ -0,0 +1,40 @@
+from app import database
+from app.utils import routing
+from app.utils.routing import StickyPrimary
+
+from fakeredis.aioredis import FakeRedis
+from sqlalchemy.ext.asyncio import create_async_engine
+import pytest
+
+@pytest.fixture
+def engines(monkeypatch, loop):
+    primary = create_async_engine("sqlite+aiosqlite:///:memory:")
+    replica = create_async_engine("sqlite+aiosqlite:///:memory:")
+    monkeypatch.setitem(database._engines, "primary", primary)
+    monkeypatch.setattr(routing, "get_replica_engine", lambda: replica)
+    monkeypatch.setattr(database, "get_replica_engine", lambda: replica)
+    yield primary, replica
+    loop.run_until_complete(primary.dispose())
+    loop.run_until_complete(replica.dispose())
+
+def read_engine(loop, api_key: str):
+    async def run():
+        sessions = routing.get_read_db(api_key)
+        session = await anext(sessions)
+        await sessions.aclose()
+        return session.bind
+    return loop.run_until_complete(run())
+
+def test_reads_stay_on_primary_without_shared_window(monkeypatch, loop, engines):
+    primary, _ = engines
+    monkeypatch.setattr(routing, "sticky_primary", StickyPrimary(5))
+    assert read_engine(loop, "abcdefghijkl-secret") is primary
+
+def test_shared_window_pins_recent_writers(monkeypatch, loop, engines):
+    primary, replica = engines
+    sticky = StickyPrimary(5, FakeRedis())
+    monkeypatch.setattr(routing, "sticky_primary", sticky)
+    assert read_engine(loop, "abcdefghijkl-secret") is replica
+    # Written through another worker, only the shared key is set
+    loop.run_until_complete(StickyPrimary(5, sticky.client).mark("abcdefghijkl-secret"))
+    assert read_engine(loop, "abcdefghijkl-secret") is primary
@@ -0,0 +1,32 @@
+from app.models import APIKey, Capsule, Conversation, User, Verification
+from app.users.crud import destroy_user
+from app.utils.helpers import current_time
+
+from tests.conftest import create_user
+from tests.test_queries import create_conversations
+from datetime import timedelta
+from sqlalchemy import func, text
+from sqlmodel import select
+
+def test_destroy_user_cascades_to_owned_rows(loop, session):
+    async def run():
+        user, api_key = await create_user(session)
+        other, _ = await create_user(session)
+        await create_conversations(session, user, 3)
+        await create_conversations(session, other, 1)
+        session.add(Verification(user_id=user.id, code=123456, expires_at=current_time() + timedelta(minutes=10)))
+        await session.commit()
+        session.expunge_all()
+        # SQLite only enforces foreign keys, and so ON DELETE CASCADE, when asked to. Turned on after
+        # seeding, since conversations and their capsules are inserted in separate statements here
+        await session.execute(text("PRAGMA foreign_keys = ON"))
+
+        assert await destroy_user(session, api_key) == {"details": "Account successfully deleted."}
+        session.expunge_all()
+        counts = {}
+        for model in (User, APIKey, Capsule, Conversation, Verification):
+            counts[model.__name__] = (await session.execute(select(func.count()).select_from(model))).scalar_one()
+        return counts
+
+    # Only the other user's account, key, conversation and its two capsules are left
+    assert loop.run_until_complete(run()) == {"User": 1, "APIKey": 1, "Capsule": 2, "Conversation": 1, "Verification": 0}